@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Startup benchmark of studip-sync.
+
+Starts a fresh interpreter for every entry point several times and reports the median wall
+time, and lists the slowest imports of each entry point as reported by "python -X importtime".
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    "interpreter": ["-c", "pass"],
+    "help": [os.path.join(ROOT, "studip_sync.py"), "--help"],
+    "config": ["-c", "import studip_sync.config"],
+    "session": ["-c", "import studip_sync.session"],
+    "sync": ["-c", "import studip_sync.studip_rsync"],
+    "parse": ["-c", "import studip_sync.parsers as p; p.parse_html('<html></html>')"],
+}
+
+
+def run(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def slowest_imports(args, count):
+    process = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=ROOT, check=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    imports = []
+    for line in process.stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only top level imports, their cumulative time includes the nested ones
+        if name.startswith("  "):
+            continue
+
+        imports.append((int(cumulative) / 1000, name.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup of studip-sync")
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help="number of runs of every entry point")
+    parser.add_argument("--top", type=int, default=5,
+                        help="number of the slowest imports listed per entry point")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, entry_args in ENTRY_POINTS.items():
+        times = [run(entry_args) for _ in range(args.repeat)]
+        results[name] = {
+            "median": round(statistics.median(times), 4),
+            "min": round(min(times), 4),
+            "imports": [{"module": module, "cumulative_ms": round(ms, 1)}
+                        for ms, module in slowest_imports(entry_args, args.top)]
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    for name, result in results.items():
+        print("{:<12} median {:7.1f} ms   min {:7.1f} ms".format(
+            name, result["median"] * 1000, result["min"] * 1000))
+        for entry in result["imports"]:
+            print("{:>16} {:7.1f} ms  {}".format("", entry["cumulative_ms"], entry["module"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Microbenchmarks of the page parsers.
+
+Times every parser on a small, a large and a pathological page and reports the statistics of
+the rounds (like pytest-benchmark) and the peak memory of a single call. Pages recorded with
+"--record" can be benchmarked as well:
+
+    ./benchmarks/bench_parsers.py --corpus ~/studip-corpus
+"""
+
+import argparse
+import html
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from studip_sync.logins.general import GeneralLogin  # noqa: E402
+from studip_sync.parsers import extract_courses, extract_files_flat, \
+    extract_files_index_data  # noqa: E402
+from studip_sync.transport import load_corpus  # noqa: E402
+
+
+def courses_page(semesters, courses, nesting=0):
+    tables = []
+    for semester in range(semesters):
+        links = "".join('<tr><td><a href="https://mock/seminar_main.php?auswahl={:032x}">'
+                        'Course {} of semester {}</a></td></tr>'.format(semester * courses + i,
+                                                                        i, semester)
+                        for i in range(courses))
+        tables.append("<table><caption>Semester {}</caption>{}</table>".format(semester, links))
+
+    return "<html><body>{}<div id=\"my_seminars\">{}</div>{}</body></html>".format(
+        "<div>" * nesting, "".join(tables), "</div>" * nesting)
+
+
+def files_page(files, folders, decoy_forms=0, nesting=0):
+    data_files = [{
+        "id": "{:032x}".format(i),
+        "name": "File <{}> \"{}\".pdf".format(i, "x" * 20),
+        "size": 1024 * i,
+        "chdate": 1600000000 + i,
+        "folder_id": "{:032x}".format(0),
+        "download_url": "https://mock/sendfile.php?type=0&file_id={:032x}".format(i)
+    } for i in range(files)]
+    data_folders = [{"id": "{:032x}".format(i), "name": "Folder {}".format(i)}
+                    for i in range(folders)]
+
+    # Forms before the files table, with attributes that look like the files table
+    decoys = "".join('<form action="#" data-note="files_table_form &gt; {}" data-x=\'>\'>'
+                     '<input type="hidden" name="security_token" value="decoy"></form>'.format(i)
+                     for i in range(decoy_forms))
+
+    return ('<html><body>{}{}<form id="files_table_form" method="post" action="#" '
+            'data-files="{}" data-folders="{}">'
+            '<input type="hidden" name="security_token" value="token">'
+            '<table><tbody><tr><td>Keine Dateien vorhanden.</td></tr></tbody></table>'
+            '</form>{}</body></html>').format("<div>" * nesting, decoys,
+                                              html.escape(json.dumps(data_files)),
+                                              html.escape(json.dumps(data_folders)),
+                                              "</div>" * nesting)
+
+
+def login_page(forms, inputs, nesting=0):
+    other_forms = "".join('<form id="search{}"><input name="q{}"></form>'.format(i, i)
+                          for i in range(forms))
+    other_inputs = "".join('<input type="hidden" name="field{}" value="{}">'.format(i, "v" * 40)
+                           for i in range(inputs))
+
+    return ('<html><body>{}{}<form action="https://mock/index.php?again=yes" method="post">'
+            '<input name="loginname"><input type="password" name="password">{}'
+            '<input type="hidden" name="security_token" value="token">'
+            '<input type="hidden" name="login_ticket" value="ticket">'
+            '<input type="hidden" name="resolution" value="">'
+            '</form>{}</body></html>').format("<div>" * nesting, other_forms, other_inputs,
+                                              "</div>" * nesting)
+
+
+PARSERS = {
+    "courses": lambda page: list(extract_courses(page, False)),
+    "files_index": extract_files_index_data,
+    "files_flat": extract_files_flat,
+    "login": GeneralLogin.extract_login_data,
+}
+
+
+def synthetic_pages():
+    return {
+        "courses": {
+            "small": courses_page(1, 5),
+            "large": courses_page(20, 50),
+            "pathological": courses_page(2, 5, nesting=2000),
+        },
+        "files_index": {
+            "small": files_page(5, 2),
+            "large": files_page(5000, 500),
+            "pathological": files_page(50, 5, decoy_forms=2000, nesting=2000),
+        },
+        "files_flat": {
+            "small": files_page(5, 2),
+            "large": files_page(5000, 500),
+            "pathological": files_page(50, 5, decoy_forms=2000, nesting=2000),
+        },
+        "login": {
+            "small": login_page(0, 0),
+            "large": login_page(50, 5000),
+            "pathological": login_page(5000, 0, nesting=2000),
+        },
+    }
+
+
+def corpus_pages(path):
+    """Returns the recorded pages of the corpus, by the parser which reads them"""
+    pages = {}
+
+    for index, entry in enumerate(load_corpus(path)):
+        if entry["body"] is None or entry["status"] != 200:
+            continue
+
+        with open(os.path.join(path, entry["body"]), "rb") as body_file:
+            page = body_file.read().decode("utf-8", "replace")
+
+        name = "corpus {:05d}".format(index)
+        if 'id="my_seminars"' in page:
+            pages.setdefault("courses", {})[name] = page
+        elif "files_table_form" in page:
+            pages.setdefault("files_index", {})[name] = page
+            pages.setdefault("files_flat", {})[name] = page
+        elif "login_ticket" in page:
+            pages.setdefault("login", {})[name] = page
+
+    return pages
+
+
+def measure(parser, page, rounds, min_time):
+    # Calibrate the number of calls per round, so that a round takes at least min_time
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            parser(page)
+        if time.perf_counter() - start >= min_time or iterations >= 1 << 20:
+            break
+        iterations *= 2
+
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            parser(page)
+        times.append((time.perf_counter() - start) / iterations)
+
+    tracemalloc.start()
+    parser(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "page_bytes": len(page.encode("utf-8")),
+        "rounds": rounds,
+        "iterations": iterations,
+        "min": min(times),
+        "max": max(times),
+        "mean": statistics.mean(times),
+        "median": statistics.median(times),
+        "stddev": statistics.stdev(times) if rounds > 1 else 0.0,
+        "ops": 1 / statistics.mean(times),
+        "peak_memory": peak
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the page parsers")
+    parser.add_argument("-r", "--rounds", type=int, default=5,
+                        help="number of timed rounds of every benchmark")
+    parser.add_argument("--min-time", type=float, default=0.1, metavar="SECONDS",
+                        help="minimal duration of a round, short calls are repeated")
+    parser.add_argument("--corpus", metavar="DIR",
+                        help="also benchmark the pages of a corpus recorded with --record")
+    parser.add_argument("-k", "--filter", default="",
+                        help="only run the benchmarks whose name contains this text")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    pages = synthetic_pages()
+    if args.corpus:
+        for parser_name, corpus in corpus_pages(args.corpus).items():
+            pages[parser_name].update(corpus)
+
+    results = {}
+    for parser_name, parser_pages in pages.items():
+        for page_name, page in parser_pages.items():
+            name = "{}[{}]".format(parser_name, page_name)
+            if args.filter in name:
+                results[name] = measure(PARSERS[parser_name], page, args.rounds, args.min_time)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    print("{:<34} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "name", "page KB", "min ms", "mean ms", "median ms", "stddev ms", "ops/s", "peak KB"))
+    for name, result in results.items():
+        print("{:<34} {:10.1f} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:10.1f} {:10.1f}".format(
+            name, result["page_bytes"] / 1024, result["min"] * 1000, result["mean"] * 1000,
+            result["median"] * 1000, result["stddev"] * 1000, result["ops"],
+            result["peak_memory"] / 1024))
+
+
+if __name__ == "__main__":
+    main()
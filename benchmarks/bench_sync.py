@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""End-to-end sync benchmark against the local Stud.IP stand-in.
+
+Runs a full sync into an empty directory, an incremental sync after some files changed on the
+server and a no-op sync, and reports wall time, request count and bytes written for each.
+Arguments after "--" are passed to studip-sync, e.g.:
+
+    ./benchmarks/bench_sync.py --courses 10 --latency 0.05 -- --jobs 8 --bulk
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_studip import add_tree_arguments, create_server
+
+STUDIP_SYNC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "studip_sync.py")
+
+
+def written_files(destination, since):
+    count = 0
+    size = 0
+
+    for root, _, files in os.walk(destination):
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            if stat.st_mtime >= since:
+                count += 1
+                size += stat.st_size
+
+    return count, size
+
+
+def run_sync(server, config_path, destination, sync_args, extra_args=()):
+    server.reset_counters()
+    started = time.time()
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, STUDIP_SYNC, "-c", config_path] +
+                             list(extra_args) + sync_args,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    wall_time = time.perf_counter() - start
+
+    files_written, bytes_written = written_files(destination, started)
+
+    return {
+        "exit_code": process.returncode,
+        "wall_time": round(wall_time, 3),
+        "requests": server.requests,
+        "throttled": server.throttled,
+        "not_modified": server.not_modified,
+        "bytes_received": server.bytes_sent,
+        "files_written": files_written,
+        "bytes_written": bytes_written,
+        "output": process.stdout.decode("utf-8", "replace")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full, incremental and no-op syncs")
+    add_tree_arguments(parser)
+    parser.add_argument("--change", type=float, default=0.1,
+                        help="fraction of files changed before the incremental sync")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--show-output", action="store_true",
+                        help="print the output of studip-sync")
+
+    argv = sys.argv[1:]
+    sync_args = []
+    if "--" in argv:
+        sync_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    server = create_server(args).start()
+
+    with tempfile.TemporaryDirectory(prefix="studip-sync-bench") as workdir:
+        config_path = os.path.join(workdir, "config", "config.json")
+        destination = os.path.join(workdir, "files")
+        os.makedirs(os.path.dirname(config_path))
+
+        with open(config_path, "w") as config_file:
+            json.dump({
+                "user": {"login": server.username, "password": server.password},
+                "base_url": server.base_url,
+                "files_destination": destination
+            }, config_file)
+
+        results = {"tree": {
+            "courses": len(server.tree.courses),
+            "folders": len(server.tree.folders),
+            "files": len(server.tree.files),
+            "bytes": server.tree.total_size()
+        }}
+
+        results["full"] = run_sync(server, config_path, destination, sync_args, ["--full"])
+
+        # Make sure that changed files are newer than the last sync
+        time.sleep(1)
+        results["tree"]["changed_files"] = server.tree.change_files(args.change)
+        results["incremental"] = run_sync(server, config_path, destination, sync_args)
+
+        results["noop"] = run_sync(server, config_path, destination, sync_args)
+
+    server.shutdown()
+
+    if args.show_output:
+        for scenario in ("full", "incremental", "noop"):
+            print("=== {} ===".format(scenario))
+            print(results[scenario]["output"])
+
+    for scenario in ("full", "incremental", "noop"):
+        del results[scenario]["output"]
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    tree = results["tree"]
+    print("{courses} courses, {folders} folders, {files} files, {bytes} bytes, "
+          "{changed_files} files changed for the incremental sync".format(**tree))
+    print("{:<12} {:>5} {:>10} {:>9} {:>9} {:>14} {:>8} {:>14}".format(
+        "scenario", "exit", "wall time", "requests", "throttled", "bytes received", "files",
+        "bytes written"))
+    for scenario in ("full", "incremental", "noop"):
+        result = results[scenario]
+        print("{:<12} {exit_code:>5} {wall_time:>9.3f}s {requests:>9} {throttled:>9} "
+              "{bytes_received:>14} {files_written:>8} {bytes_written:>14}".format(scenario,
+                                                                                    **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Local stand-in for a Stud.IP server.
+
+Serves the pages studip-sync uses (login form, my_courses, files, files/index, files/flat,
+file downloads and bulk ZIP downloads) for a synthetic course tree. The files pages have an ETag
+and are answered with 304 if they didn't change. Latency, server errors and dropped connections
+can be injected to see how a sync behaves under load.
+"""
+
+import argparse
+import hashlib
+import html
+import io
+import json
+import random
+import threading
+import time
+import urllib.parse
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_id(*parts):
+    return hashlib.md5("/".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class CourseTree(object):
+    """Synthetic courses, each with a tree of folders containing files"""
+
+    def __init__(self, courses=3, folders=3, depth=2, files=3, file_size=2048, semesters=2,
+                 duplicates=0.0, seed=0):
+        super(CourseTree, self).__init__()
+        self.random = random.Random(seed)
+        self.courses = []
+        self.folders = {}
+        self.files = {}
+
+        chdate = int(time.time()) - 3600
+
+        for c in range(courses):
+            course_id = make_id("course", c)
+            root_id = make_id("root", c)
+            self.courses.append({
+                "id": course_id,
+                "name": "Course {}".format(c),
+                "root": root_id,
+                "semester": semesters - 1 - c % semesters
+            })
+            self.folders[root_id] = {"name": "", "course": course_id, "subfolders": [],
+                                     "files": []}
+
+            stack = [(root_id, 0)]
+            while stack:
+                folder_id, level = stack.pop()
+
+                for f in range(files):
+                    file_id = make_id("file", folder_id, f)
+
+                    # A duplicate has the same content as a file published in the first course
+                    content_id = file_id
+                    if c > 0 and self.random.random() < duplicates:
+                        content_id = make_id("file", make_id("root", 0), f)
+
+                    self.files[file_id] = {"name": "File {}.pdf".format(f), "folder": folder_id,
+                                           "size": file_size, "chdate": chdate, "version": 0,
+                                           "content": content_id}
+                    self.folders[folder_id]["files"].append(file_id)
+
+                if level < depth:
+                    for f in range(folders):
+                        subfolder_id = make_id("folder", folder_id, f)
+                        self.folders[subfolder_id] = {"name": "Folder {}".format(f),
+                                                      "course": course_id, "subfolders": [],
+                                                      "files": []}
+                        self.folders[folder_id]["subfolders"].append(subfolder_id)
+                        stack.append((subfolder_id, level + 1))
+
+    def content(self, file_id):
+        file = self.files[file_id]
+        seed = "{}:{}".format(file["content"], file["version"]).encode("utf-8")
+        block = hashlib.sha256(seed).digest() * 128
+        return (block * (file["size"] // len(block) + 1))[:file["size"]]
+
+    def change_files(self, fraction):
+        """Uploads a new version of a random fraction of all files, returns their number"""
+        changed = self.random.sample(sorted(self.files), int(len(self.files) * fraction))
+        chdate = int(time.time())
+
+        for file_id in changed:
+            self.files[file_id]["version"] += 1
+            self.files[file_id]["chdate"] = chdate
+
+        return len(changed)
+
+    def course_files(self, course_id):
+        return [file_id for file_id, file in self.files.items()
+                if self.folders[file["folder"]]["course"] == course_id]
+
+    def total_size(self):
+        return sum(file["size"] for file in self.files.values())
+
+
+class MockStudIPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_throttled()
+
+    def do_POST(self):
+        self.handle_throttled()
+
+    def handle_throttled(self):
+        server = self.server
+        if not server.enter():
+            server.count_request()
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            return self.send("Too Many Requests", status=429, headers={"Retry-After": "1"})
+
+        try:
+            self.handle_request()
+        finally:
+            server.leave()
+
+    def send(self, body, status=200, content_type="text/html; charset=utf-8", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_bytes(len(body))
+
+    def send_page(self, body):
+        """Sends a page with an ETag, or 304 without it if the client has the current version"""
+        etag = '"{}"'.format(hashlib.sha1(body.encode("utf-8")).hexdigest())
+
+        if etag in (tag.strip() for tag in (self.headers.get("If-None-Match") or "").split(",")):
+            self.server.count_not_modified()
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        return self.send(body, headers={"ETag": etag})
+
+    def base_url(self):
+        return "http://{}".format(self.headers["Host"])
+
+    def files_form(self, file_ids, folder_ids):
+        tree = self.server.tree
+        data_files = [{
+            "id": file_id,
+            "name": tree.files[file_id]["name"],
+            "size": tree.files[file_id]["size"],
+            "chdate": tree.files[file_id]["chdate"],
+            "folder_id": tree.files[file_id]["folder"],
+            "download_url": "{}/sendfile.php?type=0&file_id={}".format(self.base_url(), file_id)
+        } for file_id in file_ids]
+        data_folders = [{"id": folder_id, "name": tree.folders[folder_id]["name"]}
+                        for folder_id in folder_ids]
+
+        return ('<html><body><form id="files_table_form" method="post" action="#" '
+                'data-files="{}" data-folders="{}">'
+                '<input type="hidden" name="security_token" value="mock-token">'
+                '<input type="hidden" name="parent_folder_id" value="{}">'
+                '</form></body></html>').format(html.escape(json.dumps(data_files)),
+                                                 html.escape(json.dumps(data_folders)),
+                                                 tree.files[file_ids[0]]["folder"]
+                                                 if file_ids else "")
+
+    def handle_request(self):
+        server = self.server
+        server.count_request()
+
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        form = urllib.parse.parse_qs(body)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self.send("Internal Server Error", status=500)
+
+        if url.path == "/index.php":
+            return self.send('<form method="post" action="{}/login">'
+                             '<input name="loginname"><input name="password">'
+                             '<input type="hidden" name="security_token" value="mock-token">'
+                             '<input type="hidden" name="login_ticket" value="ticket">'
+                             '</form>'.format(self.base_url()))
+
+        if url.path == "/login":
+            if form.get("loginname") != [server.username] or \
+                    form.get("password") != [server.password]:
+                return self.send('<div class="messagebox_error">Wrong credentials</div>')
+
+            return self.send("Logged in", headers={
+                "Set-Cookie": "Seminar_Session={}; Path=/".format(server.session_id)})
+
+        if "Seminar_Session={}".format(server.session_id) not in (self.headers["Cookie"] or ""):
+            return self.send('<form method="post" action="{}/login">'
+                             '<input name="loginname"></form>'.format(self.base_url()))
+
+        if url.path == "/dispatch.php/start":
+            return self.send("Meine Veranstaltungen")
+
+        if url.path == "/dispatch.php/my_courses":
+            return self.send(self.my_courses())
+
+        course_id = query.get("cid", [""])[0]
+        course = next((c for c in server.tree.courses if c["id"] == course_id), None)
+
+        if url.path == "/dispatch.php/course/files/flat" and course:
+            return self.send_page(self.files_form(server.tree.course_files(course_id), []))
+
+        if url.path == "/dispatch.php/course/files" and course:
+            folder = server.tree.folders[course["root"]]
+            return self.send_page(self.files_form(folder["files"], folder["subfolders"]))
+
+        if url.path.startswith("/dispatch.php/course/files/index/") and course:
+            folder = server.tree.folders.get(url.path.rsplit("/", 1)[1])
+            if folder is None:
+                return self.send("Not found", status=404)
+            return self.send_page(self.files_form(folder["files"], folder["subfolders"]))
+
+        if url.path == "/sendfile.php":
+            file_id = query.get("file_id", [""])[0]
+            if file_id not in server.tree.files:
+                return self.send("Not found", status=404)
+            return self.send_file(file_id)
+
+        if url.path.startswith("/dispatch.php/file/bulk/"):
+            return self.send_archive(form.get("ids[]", []))
+
+        return self.send("Not found", status=404)
+
+    def my_courses(self):
+        tree = self.server.tree
+        semesters = sorted({c["semester"] for c in tree.courses}, reverse=True)
+
+        tables = []
+        for semester in semesters:
+            links = "".join('<tr><td><a href="https://mock/seminar_main.php?auswahl={}">{}</a>'
+                            '</td></tr>'.format(c["id"], c["name"])
+                            for c in tree.courses if c["semester"] == semester)
+            tables.append("<table><caption>Semester {}</caption>{}</table>".format(semester,
+                                                                                  links))
+
+        return '<div id="my_seminars">{}</div>'.format("".join(tables))
+
+    def send_file(self, file_id):
+        content = self.server.tree.content(file_id)
+
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            return self.send(content[start:], status=206, content_type="application/pdf",
+                             headers={"Content-Range": "bytes {}-{}/{}".format(
+                                 start, len(content) - 1, len(content))})
+
+        if self.server.drop_rate and self.server.random.random() < self.server.drop_rate:
+            # Announce the whole file, but close the connection after half of it
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content[:len(content) // 2])
+            self.server.count_bytes(len(content) // 2)
+            self.close_connection = True
+            return
+
+        return self.send(content, content_type="application/pdf")
+
+    def send_archive(self, file_ids):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for file_id in file_ids:
+                if file_id in self.server.tree.files:
+                    archive.writestr(self.server.tree.files[file_id]["name"],
+                                     self.server.tree.content(file_id))
+
+        return self.send(buffer.getvalue(), content_type="application/zip")
+
+
+class MockStudIPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tree, port=0, latency=0.0, error_rate=0.0, drop_rate=0.0,
+                 capacity=0, username="user", password="password", seed=0):
+        super(MockStudIPServer, self).__init__(("127.0.0.1", port), MockStudIPHandler)
+        self.tree = tree
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.capacity = capacity
+        self.username = username
+        self.password = password
+        self.session_id = make_id("session", seed)
+        self.random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self.in_flight = 0
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}/".format(self.server_address[1])
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def enter(self):
+        """Admits a request, unless the capacity is exhausted"""
+        with self._lock:
+            if self.capacity and self.in_flight >= self.capacity:
+                self.throttled += 1
+                return False
+
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count_bytes(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.throttled = 0
+            self.not_modified = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_tree_arguments(parser):
+    parser.add_argument("--courses", type=int, default=3)
+    parser.add_argument("--folders", type=int, default=3,
+                        help="number of subfolders in every folder")
+    parser.add_argument("--depth", type=int, default=2, help="depth of the folder tree")
+    parser.add_argument("--files", type=int, default=3, help="number of files in every folder")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, metavar="BYTES")
+    parser.add_argument("--duplicates", type=float, default=0.0,
+                        help="fraction of files with the same content as a file of the first "
+                             "course")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="SECONDS",
+                        help="delay of every response")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="fraction of file downloads whose connection is dropped halfway")
+    parser.add_argument("--capacity", type=int, default=0,
+                        help="number of concurrent requests above which requests are answered "
+                             "with 429 and Retry-After")
+
+
+def create_server(args, port=0):
+    tree = CourseTree(courses=args.courses, folders=args.folders, depth=args.depth,
+                      files=args.files, file_size=args.file_size, duplicates=args.duplicates)
+    return MockStudIPServer(tree, port=port, latency=args.latency, error_rate=args.error_rate,
+                            drop_rate=args.drop_rate, capacity=args.capacity)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Stud.IP instance")
+    parser.add_argument("--port", type=int, default=8080)
+    add_tree_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args, args.port)
+    print("Serving {} courses with {} files ({} bytes) at {}".format(
+        len(server.tree.courses), len(server.tree.files), server.tree.total_size(),
+        server.base_url))
+    print("Login with '{}' / '{}'".format(server.username, server.password))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
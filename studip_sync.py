@@ -1,16 +1,103 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from studip_sync.arg_parser import ARGS
-from studip_sync.config_creator import ConfigCreator
+from studip_sync.arg_parser import parse_args
 
-if ARGS.init:
-    with ConfigCreator() as creator:
-        creator.new_config()
-    exit()
 
-else:
+def open_transport(args, config, pool):
+    if args.replay:
+        from studip_sync.transport import ReplayTransport
+        return ReplayTransport(args.replay)
+
+    if args.record:
+        from studip_sync.transport import RecordingTransport
+        return RecordingTransport(pool.adapter, args.record, [config.username])
+
+    return None
+
+
+def main():
+    args = parse_args()
+
+    # Only the modules needed by the chosen mode are imported
+    if args.init:
+        from studip_sync.config_creator import ConfigCreator
+        with ConfigCreator(args.config) as creator:
+            creator.new_config()
+        return 0
+
+    from studip_sync import output, stats
+    output.set_verbose(args.v)
+
+    if args.batch:
+        from studip_sync.batch import BatchSync, find_configs
+        config_paths = find_configs(args.batch)
+        if not config_paths:
+            print("No config files found in '{}'".format(args.batch))
+            return 1
+
+        with stats.collect(args.stats, args.profile), \
+                BatchSync(args.account_jobs, args.course_jobs, args.download_jobs,
+                          args.max_connections, args.download_order, args.large_jobs,
+                          args.large_file_size, args.limit_rate, args.retries,
+                          args.timeout, not args.no_adaptive) as batch:
+            return batch.sync(config_paths, args.full, args.recent, args.jobs, args.crawl,
+                              not args.no_cache, args.bulk)
+
+    from studip_sync.config import Config
+    from studip_sync.helpers import ConfigError
+
+    try:
+        config = Config(args.config, args.destination)
+    except ConfigError as err:
+        print(str(err))
+        print("Aborting...")
+        return 1
+
+    if args.verify or args.history is not None or args.restore_version is not None or \
+            args.prune_history:
+        # Without contacting Stud.IP, so without the session and its dependencies
+        from studip_sync.local_files import LocalFiles
+
+        with stats.collect(args.stats, args.profile), LocalFiles(config) as files:
+            if args.verify:
+                return files.verify(args.jobs, args.repair)
+
+            if args.history is not None:
+                return files.list_versions(args.history or None)
+
+            if args.restore_version is not None:
+                return files.restore_version(args.restore_version, args.restore_to)
+
+            return files.prune_history(import_old_files=True)
+
+    from studip_sync.downloader import DownloadQueue
+    from studip_sync.session import ConnectionPool
     from studip_sync.studip_rsync import StudIPRSync
-    with StudIPRSync() as s:
-        exit(s.sync(ARGS.full, ARGS.recent))
 
+    with stats.collect(args.stats, args.profile), \
+            ConnectionPool(args.max_connections, args.limit_rate, args.retries,
+                           args.timeout, not args.no_adaptive) as pool, \
+            DownloadQueue(args.download_jobs, args.download_order, args.large_jobs,
+                          args.large_file_size) as downloads, \
+            StudIPRSync(config, pool, downloads,
+                        transport=open_transport(args, config, pool)) as s:
+        if args.dry_run or args.save_plan:
+            return s.plan(args.save_plan, args.full, args.recent, args.jobs, args.course_jobs,
+                          crawl_strategy=args.crawl, use_cache=not args.no_cache)
+
+        if args.execute_plan:
+            return s.execute_plan(args.execute_plan, use_cache=not args.no_cache)
+
+        if args.daemon:
+            return s.daemon(args.recent, args.jobs, args.course_jobs,
+                            crawl_strategy=args.crawl, use_cache=not args.no_cache,
+                            bulk=args.bulk, poll_interval_min=args.poll_min,
+                            poll_interval_max=args.poll_max)
+
+        return s.sync(args.full, args.recent, args.jobs, args.course_jobs,
+                      crawl_strategy=args.crawl, use_cache=not args.no_cache, bulk=args.bulk)
+
+
+if __name__ == "__main__":
+    exit(main())
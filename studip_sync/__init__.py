@@ -15,13 +15,12 @@ def _get_config_path():
     return os.path.expanduser(path)
 
 
-def get_config_file():
+def get_config_file(config_path=None):
     import os
-    from studip_sync.arg_parser import ARGS
     from studip_sync.constants import CONFIG_FILENAME
 
-    if ARGS.config:
-        return ARGS.config
+    if config_path:
+        return config_path
     else:
         return os.path.join(CONFIG_PATH, CONFIG_FILENAME)
 
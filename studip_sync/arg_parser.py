@@ -1,7 +1,35 @@
 import argparse
 
+from studip_sync.constants import MAX_CONNECTIONS_DEFAULT, CRAWL_AUTO, CRAWL_STRATEGIES, \
+    POLL_INTERVAL_MIN_DEFAULT, POLL_INTERVAL_MAX_DEFAULT, DOWNLOAD_ORDERS, \
+    DOWNLOAD_ORDER_DEFAULT, LARGE_FILE_SIZE_DEFAULT, RETRIES_DEFAULT, TIMEOUT_DEFAULT
 
-def parse_args():
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value):
+    """Parses a number of bytes with an optional unit, e.g. 500K or 1.5M"""
+    value = value.strip().upper().rstrip("B")
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ""
+
+    try:
+        return int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: '{}'".format(value))
+
+
+def parse_download_order(value):
+    order = [key.strip() for key in value.split(",") if key.strip()]
+
+    for key in order:
+        if key not in DOWNLOAD_ORDERS:
+            raise argparse.ArgumentTypeError("invalid order: '{}' (choose from {})".format(
+                key, ", ".join(DOWNLOAD_ORDERS)))
+
+    return order
+
+
+def parse_args(args=None):
     parser = argparse.ArgumentParser(description="Synchronize Stud.IP files")
 
     parser.add_argument("-c", "--config", metavar="DIR",
@@ -22,10 +50,154 @@ def parse_args():
     parser.add_argument("--recent", action="store_true",
                         help="only download the courses of the recent semester")
 
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=4,
+                        help="number of folder listings to fetch concurrently per course "
+                             "(Default is 4)")
+
+    parser.add_argument("--course-jobs", metavar="N", type=int, default=4,
+                        help="number of courses to synchronize concurrently (Default is 4)")
+
+    parser.add_argument("--download-jobs", metavar="N", type=int, default=4,
+                        help="number of files to download concurrently (Default is 4)")
+
+    parser.add_argument("--download-order", metavar="ORDER", type=parse_download_order,
+                        default=DOWNLOAD_ORDER_DEFAULT,
+                        help="comma-separated order in which queued files are downloaded: "
+                             "'smallest' first, 'newest' first and/or courses of the most "
+                             "recent 'semester' first (Default is '{}')".format(
+                                 ",".join(DOWNLOAD_ORDER_DEFAULT)))
+
+    parser.add_argument("--large-file-size", metavar="SIZE", type=parse_size,
+                        default=LARGE_FILE_SIZE_DEFAULT,
+                        help="files of at least SIZE bytes (e.g. 100M) are downloaded by separate "
+                             "workers, so that they don't hold up smaller files (Default is "
+                             "100M)")
+
+    parser.add_argument("--large-jobs", metavar="N", type=int, default=1,
+                        help="number of large files to download concurrently, 0 downloads them "
+                             "like the other files (Default is 1)")
+
+    parser.add_argument("--limit-rate", metavar="RATE", type=parse_size, default=0,
+                        help="limit the total download rate to RATE bytes per second (e.g. 500K "
+                             "or 2M)")
+
+    parser.add_argument("--max-connections", metavar="N", type=int,
+                        default=MAX_CONNECTIONS_DEFAULT,
+                        help="maximum number of concurrent connections to the Stud.IP server "
+                             "(Default is {})".format(MAX_CONNECTIONS_DEFAULT))
+
+    parser.add_argument("--retries", metavar="N", type=int, default=RETRIES_DEFAULT,
+                        help="number of retries of a request after a server error, a lost "
+                             "connection or a timeout (Default is {})".format(RETRIES_DEFAULT))
+
+    parser.add_argument("--timeout", metavar="SECONDS", type=float, default=TIMEOUT_DEFAULT,
+                        help="time to wait for a connection or for data from the server "
+                             "(Default is {})".format(TIMEOUT_DEFAULT))
+
+    parser.add_argument("--no-adaptive", action="store_true",
+                        help="always allow --max-connections concurrent requests, instead of "
+                             "adapting the number to how the server copes with them")
+
+    parser.add_argument("--crawl", choices=CRAWL_STRATEGIES, default=CRAWL_AUTO,
+                        help="'auto' lists all files of a course with a single request if the "
+                             "folders are known from a previous sync, 'recursive' always crawls "
+                             "every folder (Default is 'auto')")
+
+    parser.add_argument("--bulk", action="store_true",
+                        help="download the new files of a folder as one ZIP archive if there "
+                             "are several of them")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't use the response cache for course and folder pages")
+
+    parser.add_argument("--verify", action="store_true",
+                        help="check the synchronized files against their checksums without "
+                             "contacting Stud.IP, reading --jobs files at the same time")
+
+    parser.add_argument("--repair", action="store_true",
+                        help="with --verify, move damaged files aside and download damaged and "
+                             "missing files again on the next sync")
+
+    parser.add_argument("--history", metavar="PATH", nargs="?", const="", default=None,
+                        help="list the previous versions of all files, or of the files below "
+                             "PATH")
+
+    parser.add_argument("--restore-version", metavar="ID", type=int, default=None,
+                        help="copy the previous version with the given id (see --history) next "
+                             "to its file, or to --restore-to")
+
+    parser.add_argument("--restore-to", metavar="PATH", default=None,
+                        help="with --restore-version, the path to restore the version to")
+
+    parser.add_argument("--prune-history", action="store_true",
+                        help="move the .old files of earlier versions into the history and "
+                             "remove the versions which the retention policy doesn't keep")
+
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the files which would be downloaded or moved and their "
+                             "total size, without changing anything")
+
+    parser.add_argument("--save-plan", metavar="FILE", default=None,
+                        help="like --dry-run, but also save the plan to FILE")
+
+    parser.add_argument("--execute-plan", metavar="FILE", default=None,
+                        help="download and move the files of a plan saved with --save-plan")
+
+    parser.add_argument("--batch", metavar="DIR", default=None,
+                        help="synchronize every account which has a config dir in DIR (e.g. "
+                             "DIR/alice/config.json) in one process, the job and connection "
+                             "limits apply to all accounts together")
+
+    parser.add_argument("--account-jobs", metavar="N", type=int, default=4,
+                        help="number of accounts to synchronize concurrently with --batch "
+                             "(Default is 4)")
+
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and check every course for new files at an interval "
+                             "which adapts to how often its files change")
+
+    parser.add_argument("--poll-min", metavar="SECONDS", type=int,
+                        default=POLL_INTERVAL_MIN_DEFAULT,
+                        help="minimum interval at which the daemon checks a course (Default is "
+                             "{})".format(POLL_INTERVAL_MIN_DEFAULT))
+
+    parser.add_argument("--poll-max", metavar="SECONDS", type=int,
+                        default=POLL_INTERVAL_MAX_DEFAULT,
+                        help="maximum interval at which the daemon checks a course (Default is "
+                             "{})".format(POLL_INTERVAL_MAX_DEFAULT))
+
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="record the responses of Stud.IP to DIR, without cookies, session "
+                             "tokens and the username, to replay them with --replay")
+
+    parser.add_argument("--replay", metavar="DIR", default=None,
+                        help="answer all requests from the responses recorded to DIR with "
+                             "--record, without network access")
+
+    parser.add_argument("--stats", metavar="FILE", default=None,
+                        help="write the time spent in every phase of the sync, the number of "
+                             "requests and the received bytes, in total and per course, as JSON "
+                             "to FILE ('-' for stdout)")
+
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="profile the sync with cProfile and write the result to FILE")
+
     parser.add_argument("-v", action="store_true",
                         help="show debug output")
 
-    return parser.parse_known_args()[0]
+    args = parser.parse_known_args(args)[0]
 
+    if args.batch:
+        # Each account of a batch is synchronized with its own config, in the normal mode
+        conflicts = [flag for flag, value in (
+            ("--destination", args.destination), ("--verify", args.verify),
+            ("--history", args.history is not None),
+            ("--restore-version", args.restore_version is not None),
+            ("--prune-history", args.prune_history), ("--dry-run", args.dry_run),
+            ("--save-plan", args.save_plan), ("--execute-plan", args.execute_plan),
+            ("--daemon", args.daemon), ("--record", args.record), ("--replay", args.replay)
+        ) if value]
+        if conflicts:
+            parser.error("--batch can't be combined with {}".format(", ".join(conflicts)))
 
-ARGS = parse_args()
+    return args
@@ -0,0 +1,89 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from studip_sync import output, stats
+from studip_sync.config import Config
+from studip_sync.constants import CONFIG_FILENAME, MAX_CONNECTIONS_DEFAULT, CRAWL_AUTO, \
+    DOWNLOAD_ORDER_DEFAULT, LARGE_FILE_SIZE_DEFAULT, RETRIES_DEFAULT, TIMEOUT_DEFAULT
+from studip_sync.downloader import DownloadQueue
+from studip_sync.helpers import ConfigError
+from studip_sync.session import ConnectionPool
+from studip_sync.studip_rsync import StudIPRSync
+
+
+def find_configs(directory):
+    """Returns the config files of all accounts, every account has a config dir of its own"""
+    return sorted(glob.glob(os.path.join(directory, "*", CONFIG_FILENAME)))
+
+
+class BatchSync(object):
+    """Synchronizes several accounts in one process.
+
+    All accounts share the kept-alive connections and the connection limit of every host, the
+    executor of the courses, the download queue and the bandwidth limit, so the limits apply to
+    all accounts together.
+    """
+
+    def __init__(self, account_jobs=1, course_jobs=1, download_jobs=1,
+                 max_connections=MAX_CONNECTIONS_DEFAULT, download_order=DOWNLOAD_ORDER_DEFAULT,
+                 large_jobs=1, large_file_size=LARGE_FILE_SIZE_DEFAULT, rate_limit=0,
+                 retries=RETRIES_DEFAULT, timeout=TIMEOUT_DEFAULT, adaptive=True):
+        super(BatchSync, self).__init__()
+        self.account_jobs = max(1, account_jobs)
+        self.pool = ConnectionPool(max_connections, rate_limit, retries, timeout, adaptive)
+        self.downloads = DownloadQueue(download_jobs, download_order, large_jobs,
+                                       large_file_size)
+        self.course_executor = ThreadPoolExecutor(max_workers=max(1, course_jobs),
+                                                  thread_name_prefix="studip-sync-course")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.course_executor.shutdown(wait=True, cancel_futures=True)
+        self.downloads.shutdown()
+        self.pool.close()
+
+    def sync(self, config_paths, sync_fully=False, sync_recent=False, jobs=1,
+             crawl_strategy=CRAWL_AUTO, use_cache=True, bulk=False):
+        """Synchronizes the accounts of the given config files. Returns 0 if all of them
+        succeeded, 2 otherwise."""
+        with ThreadPoolExecutor(max_workers=self.account_jobs) as executor:
+            futures = [
+                executor.submit(stats.bind(self.sync_account), config_path, sync_fully,
+                                sync_recent, jobs, crawl_strategy, use_cache, bulk)
+                for config_path in config_paths
+            ]
+
+            results = [(config_path, future.result())
+                       for config_path, future in zip(config_paths, futures)]
+
+        failed_accounts = [(config_path, status_code) for config_path, status_code in results
+                           if status_code != 0]
+
+        if failed_accounts:
+            print("Sync of {} of {} accounts failed:".format(len(failed_accounts),
+                                                             len(config_paths)))
+            for config_path, status_code in failed_accounts:
+                print("\t{}: exit code {}".format(config_path, status_code))
+            return 2
+
+        return 0
+
+    def sync_account(self, config_path, sync_fully, sync_recent, jobs, crawl_strategy,
+                     use_cache, bulk):
+        # The output of every account is printed at once, including the output of its courses
+        with output.buffered():
+            print("Account: {}".format(config_path))
+
+            try:
+                # Nobody can answer a prompt for the password of one of many accounts
+                config = Config(config_path, interactive=False)
+            except (ConfigError, OSError, ValueError) as e:
+                print("Loading the config failed: {}".format(e))
+                return 1
+
+            with StudIPRSync(config, self.pool, self.downloads, self.course_executor) as sync:
+                return sync.sync(sync_fully, sync_recent, jobs, crawl_strategy=crawl_strategy,
+                                 use_cache=use_cache, bulk=bulk)
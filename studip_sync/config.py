@@ -4,21 +4,21 @@ import shlex
 import subprocess
 
 from studip_sync import get_config_file
-from studip_sync.arg_parser import ARGS
-from studip_sync.config_creator import ConfigCreator
 from studip_sync.constants import URL_BASEURL_DEFAULT, AUTHENTICATION_TYPE_DEFAULT, \
-    AUTHENTICATION_TYPE_DATA_DEFAULT, AUTHENTICATION_TYPES
+    AUTHENTICATION_TYPE_DATA_DEFAULT, AUTHENTICATION_TYPES, DEDUP_MODES, DEDUP_STORE_DIRNAME, \
+    HISTORY_DIRNAME_FORMAT, HISTORY_DEFAULTS
 from studip_sync.helpers import JSONConfig, ConfigError
 
 
 class Config(JSONConfig):
 
-    def __init__(self):
-        self.args = ARGS
-
-        config_path = get_config_file()
+    def __init__(self, config_path=None, destination=None, interactive=True):
+        config_path = get_config_file(config_path)
 
+        self.config_path = config_path
         self.config_dir = os.path.dirname(config_path)
+        self.destination = destination
+        self.interactive = interactive
 
         self._username = None
         self._password = None
@@ -34,12 +34,23 @@ class Config(JSONConfig):
         if not self.username:
             raise ConfigError("Username is missing")
 
-        if not self.password:
-            raise ConfigError("Password is missing")
+        # The password is checked when it is needed, a saved login session may make it unnecessary
 
         if self.auth_type not in AUTHENTICATION_TYPES:
             raise ConfigError("Invalid auth type!")
 
+        if self.dedup is not None and self.dedup not in DEDUP_MODES:
+            raise ConfigError("Invalid dedup mode! Use one of: " + ", ".join(DEDUP_MODES))
+
+        history = self.config.get("history") if self.config else None
+        if history is not None and not isinstance(history, (bool, dict)):
+            raise ConfigError("Invalid history setting! Use true, false or an object of settings")
+
+        if self.history is not None:
+            for key, value in self.history.items():
+                if key not in HISTORY_DEFAULTS or not isinstance(value, int) or value < 0:
+                    raise ConfigError("Invalid history setting: {}".format(key))
+
     @property
     def last_sync(self):
         if not self.config:
@@ -57,7 +68,7 @@ class Config(JSONConfig):
 
         new_config = self.config
         new_config["last_sync"] = last_sync
-        ConfigCreator.replace_config(new_config)
+        self.save_config(self.config_path, new_config)
 
     @property
     def plugins(self):
@@ -72,7 +83,7 @@ class Config(JSONConfig):
 
         new_config = self.config
         new_config["plugins"] = plugins
-        ConfigCreator.replace_config(new_config)
+        self.save_config(self.config_path, new_config)
 
     def user_property(self, prop):
         if not self.config:
@@ -90,7 +101,10 @@ class Config(JSONConfig):
         if self._username:
             return self._username
 
-        self._username = self.user_property("login") or input("Username: ")
+        self._username = self.user_property("login")
+        if not self._username and self.interactive:
+            self._username = input("Username: ")
+
         return self._username
 
     def _get_password_command(self):
@@ -111,8 +125,13 @@ class Config(JSONConfig):
         if self._password:
             return self._password
 
-        self._password = self.user_property(
-            "password") or self._get_password_command() or getpass.getpass()
+        self._password = self.user_property("password") or self._get_password_command()
+        if not self._password and self.interactive:
+            self._password = getpass.getpass()
+
+        if not self._password:
+            raise ConfigError("Password is missing")
+
         return self._password
 
     @property
@@ -138,8 +157,8 @@ class Config(JSONConfig):
 
     @property
     def files_destination(self):
-        if self.args.destination is not None:
-            files_destination = self.args.destination
+        if self.destination is not None:
+            files_destination = self.destination
         else:
             if not self.config:
                 return None
@@ -155,10 +174,41 @@ class Config(JSONConfig):
 
         return self.config.get("use_new_file_structure", False)
 
+    @property
+    def dedup(self):
+        if not self.config:
+            return None
+
+        return self.config.get("dedup")
+
+    @property
+    def dedup_store(self):
+        dedup_store = self.config.get("dedup_store") if self.config else None
+        if dedup_store:
+            return os.path.expanduser(dedup_store)
+
+        return os.path.join(self.files_destination, DEDUP_STORE_DIRNAME)
 
-try:
-    CONFIG = Config()
-except ConfigError as err:
-    print(str(err))
-    print("Aborting...")
-    exit(1)
+    @property
+    def history(self):
+        """Retention policy of the previous versions of files, or None if they are kept as .old
+        files next to them (the default)"""
+        history = self.config.get("history") if self.config else None
+        if not history:
+            return None
+
+        if history is True:
+            history = {}
+
+        return dict(HISTORY_DEFAULTS, **{key: value for key, value in history.items()
+                                         if key != "path"})
+
+    @property
+    def history_dir(self):
+        history = self.config.get("history") if self.config else None
+        if isinstance(history, dict) and history.get("path"):
+            return os.path.expanduser(history["path"])
+
+        # Next to the destination, so that it isn't part of the synchronized files but usually on
+        # the same filesystem, where previous versions are hardlinked and not copied
+        return HISTORY_DIRNAME_FORMAT.format(os.path.normpath(self.files_destination))
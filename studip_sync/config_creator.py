@@ -70,8 +70,9 @@ def get_url_and_auth_type():
 class ConfigCreator(object):
     """Create a new config file interactively"""
 
-    def __init__(self):
+    def __init__(self, config_path=None):
         super(ConfigCreator, self).__init__()
+        self.config_path = config_path
         self._session = Session()
 
     def __enter__(self):
@@ -115,12 +116,10 @@ class ConfigCreator(object):
         if files_destination:
             config["files_destination"] = files_destination
 
-        path = get_config_file()
+        path = get_config_file(self.config_path)
 
         JSONConfig.save_config(path, config)
 
     @staticmethod
-    def replace_config(config):
-        path = get_config_file()
-
-        JSONConfig.save_config(path, config)
+    def replace_config(config, path=None):
+        JSONConfig.save_config(get_config_file(path), config)
@@ -3,6 +3,10 @@ from studip_sync.logins.general import GeneralLogin
 
 URL_BASEURL_DEFAULT = "https://studip.ibs-ol.de"
 CONFIG_FILENAME = "config.json"
+MANIFEST_FILENAME = "manifest.db"
+STATE_FILENAME = "state.json"
+CACHE_DIRNAME = "cache"
+COOKIES_FILENAME = "cookies.json"
 LOGIN_PRESETS = [
     LoginPreset(name="IBS Oldenburg", base_url="https://studip.ibs-ol.de",
                 auth_type="general", auth_data={}
@@ -11,3 +15,31 @@ LOGIN_PRESETS = [
 AUTHENTICATION_TYPES = {"general": GeneralLogin}
 AUTHENTICATION_TYPE_DEFAULT = "general"
 AUTHENTICATION_TYPE_DATA_DEFAULT = {}
+MAX_CONNECTIONS_DEFAULT = 8
+CRAWL_AUTO = "auto"
+CRAWL_RECURSIVE = "recursive"
+CRAWL_STRATEGIES = [CRAWL_AUTO, CRAWL_RECURSIVE]
+DEDUP_HARDLINK = "hardlink"
+DEDUP_REFLINK = "reflink"
+DEDUP_MODES = [DEDUP_HARDLINK, DEDUP_REFLINK]
+DEDUP_STORE_DIRNAME = ".studip-sync-objects"
+POLL_INTERVAL_MIN_DEFAULT = 5 * 60
+POLL_INTERVAL_MAX_DEFAULT = 24 * 60 * 60
+# Interval at which the daemon looks for new courses
+COURSE_LIST_INTERVAL = 6 * 60 * 60
+DOWNLOAD_ORDER_SMALLEST = "smallest"
+DOWNLOAD_ORDER_NEWEST = "newest"
+DOWNLOAD_ORDER_SEMESTER = "semester"
+DOWNLOAD_ORDERS = [DOWNLOAD_ORDER_SMALLEST, DOWNLOAD_ORDER_NEWEST, DOWNLOAD_ORDER_SEMESTER]
+DOWNLOAD_ORDER_DEFAULT = [DOWNLOAD_ORDER_SEMESTER, DOWNLOAD_ORDER_SMALLEST]
+# Files of at least this size are downloaded by separate workers
+LARGE_FILE_SIZE_DEFAULT = 100 * 1024 * 1024
+RETRIES_DEFAULT = 3
+TIMEOUT_DEFAULT = 60
+# Consecutive failures after which a course or a whole host is given up
+COURSE_MAX_FAILURES = 5
+HOST_MAX_FAILURES = 5
+# Time after which requests to a host which was given up are tried again
+HOST_RETRY_INTERVAL = 5 * 60
+HISTORY_DIRNAME_FORMAT = "{}-history"
+HISTORY_DEFAULTS = {"keep_last": 5, "keep_daily": 7, "keep_weekly": 4, "max_bytes": 0}
@@ -0,0 +1,115 @@
+import heapq
+
+from studip_sync.constants import POLL_INTERVAL_MIN_DEFAULT, POLL_INTERVAL_MAX_DEFAULT
+
+# A course is checked again after this fraction of the time since its files last changed
+POLL_AGE_FACTOR = 0.1
+
+
+class PollScheduler(object):
+    """Decides when every course is checked for new files next.
+
+    The more recently the files of a course changed, the more often it is checked: the interval
+    is a fraction of the time since the last change, limited by the minimum and maximum interval.
+    Courses of past semesters are checked at the maximum interval. After a failed check, the
+    course is retried with an exponential backoff.
+    """
+
+    def __init__(self, state, interval_min=POLL_INTERVAL_MIN_DEFAULT,
+                 interval_max=POLL_INTERVAL_MAX_DEFAULT):
+        super(PollScheduler, self).__init__()
+        self.state = state
+        self.interval_min = max(1, interval_min)
+        self.interval_max = max(self.interval_min, interval_max)
+        self.current_semester = None
+        self._courses = {}
+        self._queue = []
+
+    def __len__(self):
+        return len(self._courses)
+
+    def update_courses(self, courses, now):
+        """Schedules new courses and forgets the ones which are gone. A course which was
+        synchronized before (e.g. before a restart) isn't checked again before its interval has
+        passed."""
+        course_ids = {course["course_id"] for course in courses}
+        for course_id in list(self._courses):
+            if course_id not in course_ids:
+                del self._courses[course_id]
+
+        self.current_semester = max((course["semester_id"] for course in courses),
+                                    default=None)
+
+        for course in courses:
+            course_id = course["course_id"]
+            if course_id in self._courses:
+                self._courses[course_id]["course"] = course
+                continue
+
+            interval = self._interval(course, now)
+            synced = self.state.course_watermark(course_id)
+            self._schedule(course, interval, max(now, synced + interval) if synced else now)
+
+    def due(self, now):
+        """Removes and returns the courses which have to be checked now"""
+        courses = []
+        while self._queue and self._queue[0][0] <= now:
+            next_check, course_id = heapq.heappop(self._queue)
+            entry = self._courses.get(course_id)
+
+            # Skip courses which are gone or were rescheduled in the meantime
+            if entry is not None and entry["next_check"] == next_check:
+                courses.append(entry["course"])
+
+        return courses
+
+    def next_check(self):
+        """Returns the time at which the next course has to be checked or None"""
+        while self._queue:
+            next_check, course_id = self._queue[0]
+            entry = self._courses.get(course_id)
+            if entry is not None and entry["next_check"] == next_check:
+                return next_check
+
+            heapq.heappop(self._queue)
+
+        return None
+
+    def reschedule(self, course, now, failed=False):
+        entry = self._courses.get(course["course_id"])
+        if entry is None:
+            return
+
+        if failed:
+            entry["failures"] += 1
+            interval = min(self.interval_max,
+                           self.interval_min * 2 ** (entry["failures"] - 1))
+        else:
+            entry["failures"] = 0
+            interval = self._interval(course, now, entry["interval"])
+
+        self._schedule(course, interval, now + interval, entry["failures"])
+
+    def _interval(self, course, now, previous=None):
+        if self.current_semester is not None and course["semester_id"] < self.current_semester:
+            return self.interval_max
+
+        last_edit = self.state.course_last_edit(course["course_id"])
+        if not last_edit:
+            # Without a known change, back off from the minimum interval
+            if previous is None:
+                return self.interval_min
+
+            return min(self.interval_max, previous * 2)
+
+        interval = (now - last_edit) * POLL_AGE_FACTOR
+        return min(self.interval_max, max(self.interval_min, interval))
+
+    def _schedule(self, course, interval, next_check, failures=0):
+        self._courses[course["course_id"]] = {
+            "course": course,
+            "interval": interval,
+            "next_check": next_check,
+            "failures": failures
+        }
+        heapq.heappush(self._queue, (next_check, course["course_id"]))
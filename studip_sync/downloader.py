@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+from studip_sync import output, stats
+from studip_sync.constants import DOWNLOAD_ORDER_DEFAULT, DOWNLOAD_ORDER_SMALLEST, \
+    DOWNLOAD_ORDER_NEWEST, DOWNLOAD_ORDER_SEMESTER, LARGE_FILE_SIZE_DEFAULT
+
+
+def download_priority(order, file_data, course):
+    """Returns the sort key of a file for the given download order, smaller keys come first"""
+    priority = []
+    for key in order:
+        if key == DOWNLOAD_ORDER_SMALLEST:
+            priority.append(file_data["size"])
+        elif key == DOWNLOAD_ORDER_NEWEST:
+            priority.append(-file_data["chdate"])
+        elif key == DOWNLOAD_ORDER_SEMESTER:
+            # The most recent semester has the highest id
+            priority.append(-(course or {}).get("semester_id", 0))
+
+    return tuple(priority)
+
+
+class DownloadLane(object):
+    """Priority queue of downloads which is drained by a fixed number of workers. The workers
+    are started when they are needed."""
+
+    def __init__(self, jobs, name):
+        super(DownloadLane, self).__init__()
+        self.jobs = max(1, jobs)
+        self.name = name
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._shutdown = False
+
+    def submit(self, priority, func, args):
+        future = Future()
+
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot queue downloads after shutdown")
+
+            # The counter keeps the order of downloads with the same priority
+            heapq.heappush(self._queue, (priority, next(self._counter), future, func, args))
+
+            if len(self._workers) < self.jobs:
+                worker = threading.Thread(target=self._work,
+                                          name="{}_{}".format(self.name, len(self._workers)))
+                worker.start()
+                self._workers.append(worker)
+
+            self._condition.notify()
+
+        return future
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._shutdown:
+                    self._condition.wait()
+
+                if not self._queue:
+                    return
+
+                _, _, future, func, args = heapq.heappop(self._queue)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = func(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+
+            for _, _, future, _, _ in self._queue:
+                future.cancel()
+            self._queue.clear()
+
+            self._condition.notify_all()
+
+        for worker in self._workers:
+            worker.join()
+
+
+class DownloadQueue(object):
+    """Queue of file downloads which is drained by a fixed number of workers.
+
+    Queued downloads start in the given order of their files (see DOWNLOAD_ORDERS). Files of at
+    least large_file_size bytes are downloaded by large_jobs separate workers, so that a few large
+    files don't hold up many small ones.
+    """
+
+    def __init__(self, jobs=1, order=DOWNLOAD_ORDER_DEFAULT, large_jobs=1,
+                 large_file_size=LARGE_FILE_SIZE_DEFAULT):
+        super(DownloadQueue, self).__init__()
+        self.jobs = max(1, jobs)
+        self.order = order
+        self.large_file_size = large_file_size if large_jobs > 0 else 0
+
+        self._lane = DownloadLane(self.jobs, "studip-sync-download")
+        self._large_lane = None
+        if self.large_file_size:
+            self._large_lane = DownloadLane(large_jobs, "studip-sync-download-large")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, func, *args, file_data=None, course=None):
+        """Queues func(*args), which downloads the file described by file_data (a dict with its
+        size and chdate) of the given course"""
+        lane = self._lane
+        priority = ()
+
+        if file_data is not None:
+            priority = download_priority(self.order, file_data, course)
+            if self._large_lane is not None and file_data["size"] >= self.large_file_size:
+                lane = self._large_lane
+
+        return lane.submit(priority, stats.bind(output.bind(func)), args)
+
+    def shutdown(self):
+        self._lane.shutdown()
+        if self._large_lane is not None:
+            self._large_lane.shutdown()
@@ -0,0 +1,225 @@
+import datetime
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+from studip_sync.store import file_checksum, reflink
+
+HISTORY_DB_FILENAME = "history.db"
+HISTORY_OBJECTS_DIRNAME = "objects"
+
+# Previous versions which were kept next to the file before there was a history
+OLD_FILE_PATTERN = re.compile(r"^(.+)_(\d{4}-\d{2}-\d{2}_\d{2}\+\d{2}\+\d{2})\.old$")
+OLD_FILE_TIME_FORMAT = "%Y-%m-%d_%H+%M+%S"
+
+
+class VersionHistory(object):
+    """Previous versions of synchronized files, kept outside of the synchronized files.
+
+    Every version is stored once per content (keyed by its SHA-256 checksum), so identical
+    versions of a file, or of different files, share their data. Versions are removed by prune
+    according to the retention policy: the last keep_last versions of every file, the newest
+    version of each of its last keep_daily days and keep_weekly weeks, and at most max_bytes of
+    data in total (0 is unlimited), for which the oldest versions go first.
+    """
+
+    def __init__(self, path, keep_last=5, keep_daily=7, keep_weekly=4, max_bytes=0):
+        super(VersionHistory, self).__init__()
+        self.path = path
+        self.objects_path = os.path.join(path, HISTORY_OBJECTS_DIRNAME)
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.objects_path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, HISTORY_DB_FILENAME),
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("CREATE TABLE IF NOT EXISTS versions ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "path TEXT NOT NULL, "
+                         "file_id TEXT, "
+                         "saved INTEGER NOT NULL, "
+                         "size INTEGER NOT NULL, "
+                         "checksum TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS versions_path ON versions (path)")
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def object_path(self, checksum):
+        return os.path.join(self.objects_path, checksum[:2], checksum)
+
+    def add(self, file_path, file_id=None, saved=None, path=None):
+        """Saves the current content of file_path as a version of the file at path (file_path
+        itself by default). The file itself is kept."""
+        checksum = file_checksum(file_path)
+        stat = os.stat(file_path)
+        size = stat.st_size
+        saved = int(saved if saved is not None else stat.st_mtime)
+
+        object_path = self.object_path(checksum)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = "{}.{}.tmp".format(object_path, threading.get_ident())
+
+            # A hardlink is enough, the file is replaced and not modified by the sync. A file
+            # with other links (e.g. deduplicated copies in other courses) may still be modified
+            # through them, so it is copied (sharing its data if possible), as across filesystems.
+            try:
+                if stat.st_nlink > 1:
+                    reflink(file_path, temp_path)
+                else:
+                    os.link(file_path, temp_path)
+            except OSError:
+                shutil.copyfile(file_path, temp_path)
+
+            os.replace(temp_path, object_path)
+
+        with self._lock:
+            self._db.execute("INSERT INTO versions (path, file_id, saved, size, checksum) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             (path or file_path, file_id, saved, size, checksum))
+            self._db.commit()
+
+    def versions(self, path_prefix=None):
+        """Returns all versions, or those of the files below path_prefix, newest first"""
+        query = "SELECT * FROM versions"
+        params = ()
+        if path_prefix:
+            path_prefix = os.path.abspath(path_prefix)
+            query += " WHERE path = ? OR substr(path, 1, ?) = ?"
+            params = (path_prefix, len(path_prefix) + 1, os.path.join(path_prefix, ""))
+
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY path, saved DESC, id DESC",
+                                    params).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def get(self, version_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM versions WHERE id = ?",
+                                   (version_id,)).fetchone()
+
+        return dict(row) if row is not None else None
+
+    def restore(self, version, target_path):
+        """Copies the content of a version to target_path, which must not exist yet"""
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+
+        with open(self.object_path(version["checksum"]), "rb") as source, \
+                open(target_path, "xb") as target:
+            shutil.copyfileobj(source, target)
+
+        os.utime(target_path, (time.time(), version["saved"]))
+
+    def retained(self, versions):
+        """Returns the ids of the versions which the retention policy keeps"""
+        by_path = {}
+        for version in versions:
+            by_path.setdefault(version["path"], []).append(version)
+
+        kept = {}
+        for path_versions in by_path.values():
+            path_versions.sort(key=lambda v: (v["saved"], v["id"]), reverse=True)
+            kept.update((v["id"], v) for v in path_versions[:self.keep_last])
+
+            for period, count in ((_day, self.keep_daily), (_week, self.keep_weekly)):
+                periods = set()
+                for version in path_versions:
+                    if len(periods) >= count:
+                        break
+
+                    key = period(version["saved"])
+                    if key not in periods:
+                        periods.add(key)
+                        kept[version["id"]] = version
+
+        if self.max_bytes:
+            # Versions with the same content are stored once, so an object only counts once
+            references = {}
+            for version in kept.values():
+                references[version["checksum"]] = references.get(version["checksum"], 0) + 1
+
+            total = sum(v["size"] for v in {v["checksum"]: v for v in kept.values()}.values())
+
+            for version in sorted(kept.values(), key=lambda v: (v["saved"], v["id"])):
+                if total <= self.max_bytes:
+                    break
+
+                del kept[version["id"]]
+                references[version["checksum"]] -= 1
+                if not references[version["checksum"]]:
+                    total -= version["size"]
+
+        return set(kept)
+
+    def prune(self):
+        """Removes the versions which the retention policy doesn't keep and the objects which no
+        version uses anymore. Returns the number of removed versions and of freed bytes."""
+        versions = self.versions()
+        retained = self.retained(versions)
+        removed = [version["id"] for version in versions if version["id"] not in retained]
+
+        with self._lock:
+            self._db.executemany("DELETE FROM versions WHERE id = ?",
+                                 [(version_id,) for version_id in removed])
+            self._db.commit()
+            referenced = {row[0] for row in
+                          self._db.execute("SELECT DISTINCT checksum FROM versions")}
+
+        freed = 0
+        for prefix in os.scandir(self.objects_path):
+            if not prefix.is_dir():
+                continue
+
+            for entry in os.scandir(prefix.path):
+                if entry.name not in referenced:
+                    freed += entry.stat().st_size
+                    os.remove(entry.path)
+
+        return len(removed), freed
+
+    def import_old_files(self, directory):
+        """Moves the .old files of previous versions below directory into the history. Returns
+        the number of imported files."""
+        count = 0
+
+        for dir_path, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                match = OLD_FILE_PATTERN.match(file_name)
+                if not match:
+                    continue
+
+                old_file_path = os.path.join(dir_path, file_name)
+                saved = time.mktime(time.strptime(match.group(2), OLD_FILE_TIME_FORMAT))
+
+                self.add(old_file_path, saved=saved, path=os.path.join(dir_path, match.group(1)))
+                os.remove(old_file_path)
+                count += 1
+
+        return count
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def _day(timestamp):
+    return datetime.date.fromtimestamp(timestamp)
+
+
+def _week(timestamp):
+    return datetime.date.fromtimestamp(timestamp).isocalendar()[:2]
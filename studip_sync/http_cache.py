@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+
+CACHE_SIZE_DEFAULT = 64 * 1024 * 1024
+
+
+class ResponseCache(object):
+    """Size-bounded on-disk cache of parsed responses together with their HTTP validators.
+
+    Entries are only stored if the server sent an ETag or Last-Modified header, so that they can
+    be revalidated with a conditional request. The least recently used entries are evicted first.
+    """
+
+    def __init__(self, path, max_size=CACHE_SIZE_DEFAULT):
+        super(ResponseCache, self).__init__()
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        self._sizes = {}
+        for entry in os.scandir(path):
+            if entry.is_file() and entry.name.endswith(".json"):
+                self._sizes[entry.name] = entry.stat().st_size
+
+    @staticmethod
+    def _key(url, params, variant):
+        key = json.dumps([url, sorted((params or {}).items()), variant])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+
+    def get(self, url, params=None, variant=""):
+        name = self._key(url, params, variant)
+        path = os.path.join(self.path, name)
+
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        # Mark as recently used for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return entry
+
+    def put(self, url, params, headers, result, variant=""):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+
+        name = self._key(url, params, variant)
+        path = os.path.join(self.path, name)
+        data = json.dumps({
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "result": result
+        })
+
+        with self._lock:
+            temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            with open(temp_path, "w") as entry_file:
+                entry_file.write(data)
+            os.replace(temp_path, path)
+
+            self._sizes[name] = len(data.encode("utf-8"))
+            self._evict()
+
+    def _evict(self):
+        total_size = sum(self._sizes.values())
+        if total_size <= self.max_size:
+            return
+
+        def last_used(name):
+            try:
+                return os.path.getmtime(os.path.join(self.path, name))
+            except OSError:
+                return 0
+
+        for name in sorted(self._sizes, key=last_used):
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+            total_size -= self._sizes.pop(name)
+
+    @staticmethod
+    def validators(entry):
+        """Returns the headers for a conditional request for the cached entry"""
+        headers = {}
+
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
@@ -0,0 +1,179 @@
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+import os
+import time
+
+from studip_sync import stats
+from studip_sync.constants import MANIFEST_FILENAME, STATE_FILENAME
+from studip_sync.history import VersionHistory
+from studip_sync.manifest import Manifest
+from studip_sync.state import SyncState
+from studip_sync.store import ObjectStore
+from studip_sync.verify import verify_files, VERIFY_OK, VERIFY_MISSING, VERIFY_SIZE, \
+    VERIFY_CHECKSUM, VERIFY_UNKNOWN
+
+
+class LocalFiles(object):
+    """The synchronized files of one account with their manifest, sync state, store and history.
+    Checks and maintains them without contacting Stud.IP, so that these modes don't need the
+    session and its dependencies."""
+
+    def __init__(self, config):
+        super(LocalFiles, self).__init__()
+        self.config = config
+        self.files_destination_dir = config.files_destination
+
+        self.store = None
+        self.history = None
+
+        if self.files_destination_dir:
+            os.makedirs(self.files_destination_dir, exist_ok=True)
+
+            if config.dedup:
+                self.store = ObjectStore(config.dedup_store, config.dedup)
+
+            if config.history is not None:
+                self.history = VersionHistory(config.history_dir, **config.history)
+
+    def verify(self, jobs=1, repair=False):
+        """Checks the synchronized files against the checksums in the manifest, without
+        contacting Stud.IP. With repair, damaged and missing files are downloaded again by the
+        next sync."""
+        if not self.files_destination_dir:
+            print("Nothing to verify without a destination directory!")
+            return 1
+
+        messages = {
+            VERIFY_MISSING: "Missing",
+            VERIFY_SIZE: "Size differs",
+            VERIFY_CHECKSUM: "Checksum differs"
+        }
+
+        with self.open_manifest() as manifest, self.open_state() as state:
+            entries = manifest.entries()
+            print("Verifying {} files...".format(len(entries)))
+
+            results = Counter()
+            failed_entries = []
+            for entry, result in verify_files(entries, jobs):
+                results[result] += 1
+
+                if result in messages:
+                    print("\t{}: {}".format(messages[result], entry["path"]))
+                    failed_entries.append(entry)
+
+            if repair:
+                for entry in failed_entries:
+                    self.repair_file(manifest, state, entry)
+
+        print("{} files are intact, {} are damaged and {} are missing".format(
+            results[VERIFY_OK], results[VERIFY_SIZE] + results[VERIFY_CHECKSUM],
+            results[VERIFY_MISSING]))
+
+        if results[VERIFY_UNKNOWN]:
+            print("{} files have no checksum and were only checked by their size".format(
+                results[VERIFY_UNKNOWN]))
+
+        if repair and failed_entries:
+            print("The damaged and missing files will be downloaded again by the next sync")
+
+        return 2 if results[VERIFY_SIZE] or results[VERIFY_CHECKSUM] else 0
+
+    def list_versions(self, path=None):
+        """Prints the previous versions of all files, or of the files below path"""
+        if self.history is None:
+            print("The history of previous versions is disabled!")
+            return 1
+
+        file_path = None
+        for version in self.history.versions(path):
+            if version["path"] != file_path:
+                file_path = version["path"]
+                print(file_path)
+
+            print("\t{:>6}  {}  {:>12} bytes".format(
+                version["id"], time.strftime("%d.%m.%Y %H:%M", time.localtime(version["saved"])),
+                version["size"]))
+
+        return 0
+
+    def restore_version(self, version_id, target_path=None):
+        """Copies a previous version of a file next to it (or to target_path)"""
+        if self.history is None:
+            print("The history of previous versions is disabled!")
+            return 1
+
+        version = self.history.get(version_id)
+        if version is None:
+            print("There is no version {}!".format(version_id))
+            return 1
+
+        if target_path is None:
+            file_path_root, file_path_ext = os.path.splitext(version["path"])
+            timestr = datetime.strftime(datetime.fromtimestamp(version["saved"]),
+                                        "%Y-%m-%d_%H+%M+%S")
+            target_path = "{}_{}{}".format(file_path_root, timestr, file_path_ext)
+
+        try:
+            self.history.restore(version, target_path)
+        except OSError as e:
+            print("Restoring the version failed: {}".format(e))
+            return 1
+
+        print("Restored version {} to {}".format(version_id, target_path))
+        return 0
+
+    def prune_history(self, import_old_files=False):
+        """Removes the previous versions which the retention policy doesn't keep. With
+        import_old_files, the .old files kept by earlier syncs are moved into the history first."""
+        if self.history is None:
+            print("The history of previous versions is disabled!")
+            return 1
+
+        if import_old_files:
+            count = self.history.import_old_files(self.files_destination_dir)
+            if count:
+                print("Moved {} .old files into the history".format(count))
+
+        with stats.phase("files"):
+            count, size = self.history.prune()
+
+        if count:
+            print("Removed {} old versions ({} bytes) from the history".format(count, size))
+
+        return 0
+
+    def repair_file(self, manifest, state, entry):
+        file_path = entry["path"]
+
+        if os.path.exists(file_path):
+            # A damaged object in the store must not be linked again
+            if self.store is not None and entry["checksum"]:
+                self.store.discard(file_path, entry["checksum"])
+
+            timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
+            os.rename(file_path, "{}_{}.damaged".format(file_path, timestr))
+
+        manifest.remove(entry["file_id"])
+        if entry["course_id"]:
+            state.reset_course(entry["course_id"])
+
+    def open_manifest(self):
+        if not self.files_destination_dir:
+            return nullcontext()
+
+        return Manifest(os.path.join(self.config.config_dir, MANIFEST_FILENAME))
+
+    def open_state(self, read_only=False):
+        if not self.files_destination_dir:
+            return nullcontext()
+
+        return SyncState(os.path.join(self.config.config_dir, STATE_FILENAME), read_only)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.history is not None:
+            self.history.close()
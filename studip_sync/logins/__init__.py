@@ -9,6 +9,10 @@ class LoginBase:
     def login(session, username, password, auth_type_data):
         raise NotImplemented()
 
+    @staticmethod
+    def is_logged_in(session):
+        return False
+
 
 class LoginPreset:
 
@@ -1,7 +1,5 @@
-from bs4 import BeautifulSoup
-
 from studip_sync.logins import LoginBase, LoginError
-from studip_sync.parsers import ParserError
+from studip_sync.parsers import ParserError, parse_html
 
 
 class GeneralLogin(LoginBase):
@@ -15,7 +13,7 @@ class GeneralLogin(LoginBase):
 
     @staticmethod
     def login(session, username, password, auth_type_data):
-        with session.session.get(session.url.login_page()) as response:
+        with session.request("GET", session.url.login_page()) as response:
             if not response.ok:
                 raise LoginError("Cannot access Stud.IP login page")
             login_data = GeneralLogin.extract_login_data(response.text)
@@ -27,20 +25,26 @@ class GeneralLogin(LoginBase):
 
         login_params = {**login_params_auth, **login_data['params']}
 
-        with session.session.post(login_data['action'], data=login_params) as response:
+        with session.request("POST", login_data['action'], data=login_params) as response:
             if not response.ok:
                 raise LoginError("Cannot post login data")
             elif "messagebox_error" in response.text:
                 raise LoginError("Wrong credentials, cannot login")
 
         # Test if logged in
-        with session.session.post(session.url.studip_main()) as response:
+        with session.request("POST", session.url.studip_main()) as response:
             if not response.ok or "Veranstaltungen" not in response.text:
                 raise LoginError("Cannot access Stud.IP main page")
 
+    @staticmethod
+    def is_logged_in(session):
+        with session.request("GET", session.url.studip_main()) as response:
+            return response.ok and "Veranstaltungen" in response.text and \
+                'name="loginname"' not in response.text
+
     @staticmethod
     def extract_login_data(html):
-        soup = BeautifulSoup(html, 'lxml')
+        soup = parse_html(html)
 
         response = {}
 
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import threading
+
+COMMIT_INTERVAL = 100
+
+
+class Manifest(object):
+    """Local database of all synchronized files, keyed by their Stud.IP file id. The ids of the
+    files which were added, changed, moved or removed since it was opened are kept in changed."""
+
+    def __init__(self, path):
+        super(Manifest, self).__init__()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self.changed = set()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("CREATE TABLE IF NOT EXISTS files ("
+                         "file_id TEXT PRIMARY KEY, "
+                         "course_id TEXT, "
+                         "chdate INTEGER NOT NULL, "
+                         "size INTEGER NOT NULL, "
+                         "path TEXT NOT NULL, "
+                         "checksum TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, file_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM files WHERE file_id = ?",
+                                   (file_id,)).fetchone()
+
+        return dict(row) if row is not None else None
+
+    def update(self, file_id, course_id, chdate, size, path, checksum=None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files "
+                             "(file_id, course_id, chdate, size, path, checksum) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (file_id, course_id, chdate, size, path, checksum))
+            self.changed.add(file_id)
+            self._commit_later()
+
+    def entries(self):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM files").fetchall()
+
+        return [dict(row) for row in rows]
+
+    def checksums(self):
+        with self._lock:
+            return {row[0] for row in self._db.execute(
+                "SELECT DISTINCT checksum FROM files WHERE checksum IS NOT NULL")}
+
+    def update_checksum(self, file_id, checksum):
+        with self._lock:
+            self._db.execute("UPDATE files SET checksum = ? WHERE file_id = ?",
+                             (checksum, file_id))
+            self._commit_later()
+
+    def remove(self, file_id):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self.changed.add(file_id)
+            self._commit_later()
+
+    def update_path(self, file_id, path):
+        with self._lock:
+            self._db.execute("UPDATE files SET path = ? WHERE file_id = ?", (path, file_id))
+            self.changed.add(file_id)
+            self._commit_later()
+
+    def _commit_later(self):
+        # Losing uncommitted entries is harmless, those files are checked on the disk again
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,105 @@
+import io
+import sys
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_verbose = False
+
+
+class OutputBuffer(object):
+    """Collects everything printed by the threads working on one unit (e.g. one course)"""
+
+    def __init__(self):
+        super(OutputBuffer, self).__init__()
+        self._lock = threading.Lock()
+        self._buffer = io.StringIO()
+
+    def write(self, text):
+        with self._lock:
+            return self._buffer.write(text)
+
+    def getvalue(self):
+        with self._lock:
+            return self._buffer.getvalue()
+
+
+class ThreadLocalStdout(object):
+    """Proxy for sys.stdout which redirects writes to the buffer of the current thread"""
+
+    def __init__(self, stream):
+        super(ThreadLocalStdout, self).__init__()
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(_local, "buffer", None)
+        if buffer is None:
+            with _write_lock:
+                return self.stream.write(text)
+
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(_local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _install():
+    if not isinstance(sys.stdout, ThreadLocalStdout):
+        sys.stdout = ThreadLocalStdout(sys.stdout)
+
+    return sys.stdout
+
+
+@contextmanager
+def buffered():
+    """Buffers the output of the current thread and writes it at once when leaving the block"""
+    stdout = _install()
+    previous = getattr(_local, "buffer", None)
+    buffer = OutputBuffer()
+    _local.buffer = buffer
+
+    try:
+        yield buffer
+    finally:
+        _local.buffer = previous
+
+        if previous is not None:
+            previous.write(buffer.getvalue())
+        else:
+            with _write_lock:
+                stdout.stream.write(buffer.getvalue())
+                stdout.stream.flush()
+
+
+def bind(func):
+    """Wraps func so that it writes into the output buffer of the calling thread, even if it is
+    executed by another thread"""
+    buffer = getattr(_local, "buffer", None)
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        previous = getattr(_local, "buffer", None)
+        _local.buffer = buffer
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.buffer = previous
+
+    return inner
+
+
+def set_verbose(verbose):
+    global _verbose
+    _verbose = verbose
+
+
+def debug(message):
+    if _verbose:
+        print("[Debug] " + message)
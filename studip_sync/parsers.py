@@ -1,10 +1,14 @@
-import cgi
+import email.utils
 import json
 import re
+import time
 import urllib.parse
 
 from functools import wraps
-from bs4 import BeautifulSoup
+
+# Start tag of an element, attribute values may contain ">"
+START_TAG_PATTERN = r"<{}\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>"
+FORM_START_TAG = re.compile(START_TAG_PATTERN.format("form"), re.IGNORECASE)
 
 
 def log_html_on_exception():
@@ -23,12 +27,43 @@ def log_html_on_exception():
     return decorator
 
 
-def try_parser_functions(html, func_attempts):
-    soup = BeautifulSoup(html, 'lxml')
+def parse_html(html):
+    """Parses the page. Extractors which read the same page accept the soup, so that the page is
+    parsed once."""
+    # Imported on first use, pages answered from the response cache are never parsed
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, 'lxml')
+
+
+def find_form_attributes(html, form_id):
+    """Returns the attributes of the form with the given id without parsing the whole page or
+    None if the form can't be found this way"""
+    try:
+        import lxml.html
+    except ImportError:
+        return None
+
+    for match in FORM_START_TAG.finditer(html):
+        start_tag = match.group(0)
+        if form_id not in start_tag:
+            continue
+
+        try:
+            form = lxml.html.fragment_fromstring(start_tag + "</form>")
+        except Exception:
+            continue
+
+        if form.get("id") == form_id:
+            return dict(form.attrib)
 
+    return None
+
+
+def try_parser_functions(html, func_attempts):
     for func_attempt in func_attempts:
         try:
-            return func_attempt(html, soup)
+            return func_attempt(html)
         except ParserError:
             continue
 
@@ -39,77 +74,109 @@ class ParserError(Exception):
     pass
 
 
-@log_html_on_exception()
-def extract_files_flat_last_edit(html):
-    def extract_json(_, s):
-        form = s.find('form', id="files_table_form")
+def get_files_table_form_attributes(html):
+    """Returns the attributes of form#files_table_form, from the targeted lxml path or from the
+    complete page if it fails"""
+    attributes = find_form_attributes(html, "files_table_form")
+
+    if attributes is None or "data-files" not in attributes:
+        form = parse_html(html).find('form', id="files_table_form")
 
         if not form:
-            raise ParserError("last_edit: files_table_form not found")
-
-        if "data-files" not in form.attrs:
-            raise ParserError("last_edit: Missing data-files attribute in form")
-
-        form_data_files = json.loads(form.attrs["data-files"])
-
-        file_timestamps = []
-
-        for file_data in form_data_files:
-            if "chdate" not in file_data:
-                raise ParserError("last_edit: No chdate: " + str(file_data.keys()))
-
-            file_timestamps.append(file_data["chdate"])
-
-        if len(file_timestamps) > 0:
-            return max(file_timestamps)
-        else:
-            return 0
-
-    def extract_html_table(_, s):
-        for form in s.find_all('form'):
-            if 'action' in form.attrs:
-                tds = form.find('table').find('tbody').find_all('tr')[0].find_all('td')
-                if len(tds) == 8:
-                    td = tds[6]
-                    if 'data-sort-value' in td.attrs:
-                        try:
-                            return int(td.attrs['data-sort-value'])
-                        except:
-                            raise ParserError("last_edit: Couldn't convert data-sort-value to int")
-                    else:
-                        raise ParserError(
-                            "last_edit: Couldn't find td object with data-sort-value")
-                elif len(tds) == 1 and "Keine Dateien vorhanden." in str(tds[0]):
-                    return 0  # No files, so no information when was the last time a file was edited
+            return None
+
+        attributes = form.attrs
+
+    return attributes
+
+
+@log_html_on_exception()
+def extract_files_flat(html):
+    """Returns the last edit of any file on the flat view and its data-files, or None instead of
+    them if they are missing and the last edit is read from the files table. The page is parsed
+    at most once."""
+    soup = None
+    form_data_files = None
+
+    attributes = find_form_attributes(html, "files_table_form")
+    if attributes is None or "data-files" not in attributes:
+        soup = parse_html(html)
+        form = soup.find('form', id="files_table_form")
+        attributes = form.attrs if form else {}
+
+    if "data-files" in attributes:
+        form_data_files = json.loads(attributes["data-files"])
+
+        try:
+            return get_last_edit(form_data_files), form_data_files
+        except ParserError:
+            pass
+
+    return extract_files_flat_last_edit(html, soup), None
+
+
+@log_html_on_exception()
+def extract_files_flat_last_edit(html, soup=None):
+    """Returns the last edit of any file in the files table of the flat view"""
+    soup = soup if soup is not None else parse_html(html)
+
+    for form in soup.find_all('form'):
+        if 'action' in form.attrs:
+            tds = form.find('table').find('tbody').find_all('tr')[0].find_all('td')
+            if len(tds) == 8:
+                td = tds[6]
+                if 'data-sort-value' in td.attrs:
+                    try:
+                        return int(td.attrs['data-sort-value'])
+                    except:
+                        raise ParserError("last_edit: Couldn't convert data-sort-value to int")
                 else:
-                    raise ParserError("last_edit: row doesn't have expected length of cells")
+                    raise ParserError("last_edit: Couldn't find td object with data-sort-value")
+            elif len(tds) == 1 and "Keine Dateien vorhanden." in str(tds[0]):
+                return 0  # No files, so no information when was the last time a file was edited
+            else:
+                raise ParserError("last_edit: row doesn't have expected length of cells")
+
+    raise ParserError("last_edit: Found no valid form")
+
+
+def get_last_edit(form_data_files):
+    file_timestamps = []
+
+    for file_data in form_data_files:
+        if "chdate" not in file_data:
+            raise ParserError("last_edit: No chdate: " + str(file_data.keys()))
 
-        raise ParserError("last_edit: Found no valid form")
+        file_timestamps.append(file_data["chdate"])
 
-    return try_parser_functions(html, [extract_json, extract_html_table])
+    if len(file_timestamps) > 0:
+        return max(file_timestamps)
+    else:
+        return 0
 
 
 @log_html_on_exception()
 def extract_files_index_data(html):
-    soup = BeautifulSoup(html, 'lxml')
+    attributes = get_files_table_form_attributes(html)
 
-    form = soup.find('form', id="files_table_form")
+    if attributes is None:
+        raise ParserError("index_data: files_table_form not found")
 
-    if "data-files" not in form.attrs:
+    if "data-files" not in attributes:
         raise ParserError("index_data: Missing data-files attribute in form")
 
-    if "data-folders" not in form.attrs:
+    if "data-folders" not in attributes:
         raise ParserError("index_data: Missing data-folders attribute in form")
 
-    form_data_files = json.loads(form["data-files"])
-    form_data_folders = json.loads(form["data-folders"])
+    form_data_files = json.loads(attributes["data-files"])
+    form_data_folders = json.loads(attributes["data-folders"])
 
     return form_data_files, form_data_folders
 
 
 @log_html_on_exception()
-def extract_parent_folder_id(html):
-    soup = BeautifulSoup(html, 'lxml')
+def extract_parent_folder_id(html, soup=None):
+    soup = soup if soup is not None else parse_html(html)
     folder_ids = soup.find_all(attrs={"name": "parent_folder_id"})
 
     if len(folder_ids) != 1:
@@ -119,8 +186,8 @@ def extract_parent_folder_id(html):
 
 
 @log_html_on_exception()
-def extract_csrf_token(html):
-    soup = BeautifulSoup(html, 'lxml')
+def extract_csrf_token(html, soup=None):
+    soup = soup if soup is not None else parse_html(html)
     tokens = soup.find_all("input", attrs={"name": "security_token"})
 
     if len(tokens) < 1:
@@ -131,7 +198,7 @@ def extract_csrf_token(html):
 
 @log_html_on_exception()
 def extract_courses(html, only_recent_semester):
-    soup = BeautifulSoup(html, 'lxml')
+    soup = parse_html(html)
 
     div = soup.find("div", id="my_seminars")
     tables = div.find_all("table")
@@ -166,12 +233,45 @@ def extract_courses(html, only_recent_semester):
             }
 
 
+def extract_content_range(headers):
+    """Returns start, end and total length (None if unknown) of a Content-Range header"""
+    if "Content-Range" not in headers:
+        raise ParserError("content_range: \"Content-Range\" is missing")
+
+    match = re.match(r"^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$", headers["Content-Range"])
+    if not match:
+        raise ParserError("content_range: Invalid value: " + headers["Content-Range"])
+
+    start, end, total = match.groups()
+    return int(start), int(end), int(total) if total != "*" else None
+
+
+def extract_retry_after(headers):
+    """Returns the number of seconds to wait according to a Retry-After header (given in seconds
+    or as a date), or None if there is no valid one"""
+    value = headers.get("Retry-After", "").strip()
+    if not value:
+        return None
+
+    if value.isdigit():
+        return int(value)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0, retry_at.timestamp() - time.time())
+
+
 @log_html_on_exception()
 def extract_filename_from_headers(headers):
     if "Content-Disposition" not in headers:
         raise ParserError(
             "media_filename_headers: \"Content-Disposition\" is missing")
 
+    import cgi
+
     content_disposition = headers["Content-Disposition"]
 
     header_value, header_params = cgi.parse_header(content_disposition)
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+
+PLAN_VERSION = 1
+
+REASON_NEW = "new"
+REASON_CHANGED = "changed"
+REASON_MOVED = "moved"
+
+
+class SyncPlan(object):
+    """Files which a sync has to download or move, found by crawling and comparing all courses
+    without changing anything. A plan can be saved and executed later."""
+
+    def __init__(self, base_url=None, files=None, created=None):
+        super(SyncPlan, self).__init__()
+        self.base_url = base_url
+        self.files = files if files is not None else []
+        self.created = created if created is not None else int(time.time())
+        self._lock = threading.Lock()
+
+    def add(self, course, root_folder, folder_path_relative, file_data, reason, moved_from=None):
+        with self._lock:
+            self.files.append({
+                "course_id": course["course_id"],
+                "course": course["save_as"],
+                "semester": course["semester"],
+                "semester_id": course.get("semester_id", 0),
+                "root_folder": root_folder,
+                "folder": folder_path_relative,
+                "path": os.path.join(root_folder, folder_path_relative, file_data["name"]),
+                "moved_from": moved_from,
+                "reason": reason,
+                "file": {key: file_data[key]
+                         for key in ("id", "name", "size", "chdate", "download_url")}
+            })
+
+    @property
+    def download_size(self):
+        return sum(entry["file"]["size"] for entry in self.files
+                   if entry["reason"] != REASON_MOVED)
+
+    def save(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as plan_file:
+            json.dump({
+                "version": PLAN_VERSION,
+                "created": self.created,
+                "base_url": self.base_url,
+                "files": self.files
+            }, plan_file, indent=4)
+
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as plan_file:
+            data = json.load(plan_file)
+
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError("Unsupported plan version: {}".format(data.get("version")))
+
+        return cls(data.get("base_url"), data["files"], data.get("created"))
+
+    def print_summary(self):
+        course = None
+        for entry in sorted(self.files, key=lambda e: (e["semester"], e["course"], e["path"])):
+            if entry["course"] != course:
+                course = entry["course"]
+                print("{}: {}".format(entry["semester"], course))
+
+            if entry["reason"] == REASON_MOVED:
+                print("\tmove {} -> {}".format(entry["moved_from"], entry["path"]))
+            elif entry["moved_from"]:
+                print("\t{} {} ({} bytes, moved from {})".format(
+                    entry["reason"], entry["path"], entry["file"]["size"], entry["moved_from"]))
+            else:
+                print("\t{} {} ({} bytes)".format(entry["reason"], entry["path"],
+                                                  entry["file"]["size"]))
+
+        moves = sum(1 for entry in self.files if entry["reason"] == REASON_MOVED)
+        print("{} files to download ({:.1f} MB), {} files to move".format(
+            len(self.files) - moves, self.download_size / 1024 / 1024, moves))
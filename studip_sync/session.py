@@ -1,12 +1,41 @@
+import hashlib
+import json
 import os
-import shutil
+import random
+import threading
 import time
 import urllib.parse
+from contextlib import contextmanager
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
-from studip_sync import parsers
-from studip_sync.constants import URL_BASEURL_DEFAULT, AUTHENTICATION_TYPES
+from studip_sync import output, parsers, stats
+from studip_sync.constants import URL_BASEURL_DEFAULT, AUTHENTICATION_TYPES, \
+    MAX_CONNECTIONS_DEFAULT, RETRIES_DEFAULT, TIMEOUT_DEFAULT, HOST_MAX_FAILURES, \
+    HOST_RETRY_INTERVAL
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Responses which indicate a transient failure of the server
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_BACKOFF_BASE = 1
+RETRY_BACKOFF_MAX = 30
+# Responses with which the server asks to send fewer requests
+THROTTLE_STATUS_CODES = {429, 503}
+# Longest pause requested by Retry-After which is obeyed
+RETRY_AFTER_MAX = 10 * 60
+
+# Concurrent requests to a host at the start, the limit grows up to max_connections
+ADAPTIVE_INITIAL_LIMIT = 2
+# Latency above this multiple of the lowest latency of a host is seen as an overload
+ADAPTIVE_LATENCY_TOLERANCE = 2
+# Weight of a new latency in the moving average
+ADAPTIVE_LATENCY_WEIGHT = 0.2
+# The limit is cut at most once per interval, a burst of errors counts once
+ADAPTIVE_DECREASE_INTERVAL = 1
 
 
 class SessionError(Exception):
@@ -29,6 +58,19 @@ class DownloadError(SessionError):
     pass
 
 
+class HostUnavailableError(SessionError):
+    pass
+
+
+class ConnectionLostError(DownloadError):
+    pass
+
+
+# Errors after which a partial download is kept, so that the next sync resumes it
+RESUMABLE_DOWNLOAD_ERRORS = (ConnectionLostError, HostUnavailableError, requests.ConnectionError,
+                             requests.Timeout)
+
+
 class URL(object):
     def __init__(self, base_url):
         self.base_url = base_url
@@ -58,60 +100,537 @@ class URL(object):
         return self.__relative_url("dispatch.php/my_courses")
 
 
+class TokenBucket(object):
+    """Limits the number of bytes per second shared by several threads. After being idle, up to
+    one second worth of bytes can be transferred at once."""
+
+    def __init__(self, rate):
+        super(TokenBucket, self).__init__()
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Waits until amount bytes may be transferred"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # The tokens may become negative, the following transfers wait until they are repaid
+            self._tokens -= amount
+            delay = -self._tokens / self.rate
+
+        if delay > 0:
+            with stats.phase("wait"):
+                time.sleep(delay)
+
+
+class AdaptiveLimit(object):
+    """Limits the number of concurrent requests to a host and adapts the limit to how the host
+    copes with them: it grows by one per round of requests while the latency is stable and is
+    halved if the host throttles (429 or 503) or its latency rises (AIMD). The latency is compared
+    per kind of request (e.g. pages and downloads), which take different times without any
+    congestion. A pause requested by Retry-After holds back all requests to the host. If not
+    adaptive, the limit is max_limit."""
+
+    def __init__(self, max_limit, adaptive=True):
+        super(AdaptiveLimit, self).__init__()
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.limit = min(max_limit, ADAPTIVE_INITIAL_LIMIT) if adaptive else max_limit
+        self.in_flight = 0
+
+        # Average and lowest latency by kind of request
+        self._latency = {}
+        self._min_latency = {}
+        self._decreased = 0
+        self._paused_until = 0
+        self._condition = threading.Condition()
+        self._local = threading.local()
+
+    def acquire(self):
+        held = getattr(self._local, "held", 0)
+
+        with self._condition:
+            # A thread which holds a slot already (while logging in again) must not wait for
+            # itself
+            while not held:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self._condition.wait()
+
+            self.in_flight += 1
+
+        self._local.held = held + 1
+
+    def release(self):
+        self._local.held -= 1
+
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def update(self, latency, throttled=False, retry_after=None, kind=None):
+        """Adapts the limit to a response of the given kind of request which took latency
+        seconds"""
+        with self._condition:
+            now = time.monotonic()
+            if retry_after:
+                self._paused_until = max(self._paused_until,
+                                         now + min(retry_after, RETRY_AFTER_MAX))
+
+            if not self.adaptive:
+                return
+
+            if throttled:
+                self._decrease(now, "throttled")
+                return
+
+            average = self._latency.get(kind)
+            if average is None:
+                average = latency
+            else:
+                average += ADAPTIVE_LATENCY_WEIGHT * (latency - average)
+            self._latency[kind] = average
+
+            # The lowest latency slowly follows the latency up, in case the host got slower for
+            # good
+            lowest = self._min_latency.get(kind)
+            if lowest is None or latency < lowest:
+                lowest = latency
+            else:
+                lowest += ADAPTIVE_LATENCY_WEIGHT / 100 * (latency - lowest)
+            self._min_latency[kind] = lowest
+
+            if average > ADAPTIVE_LATENCY_TOLERANCE * lowest:
+                self._decrease(now, "latency {:.0f} ms".format(average * 1000))
+            elif self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._condition.notify_all()
+
+    def _decrease(self, now, reason):
+        if now - self._decreased < ADAPTIVE_DECREASE_INTERVAL:
+            return
+
+        self._decreased = now
+        self.limit = max(1, self.limit / 2)
+        # Fresh averages, so the limit isn't cut again for the latency before this cut
+        self._latency = {}
+        output.debug("Concurrent requests reduced to {} ({})".format(int(self.limit), reason))
+
+
+class CircuitBreaker(object):
+    """Counts consecutive failures. After max_failures of them, the breaker is open: everything
+    is given up until retry_interval seconds have passed (or forever, if it is None)."""
+
+    def __init__(self, max_failures, retry_interval=None):
+        super(CircuitBreaker, self).__init__()
+        self.max_failures = max_failures
+        self.retry_interval = retry_interval
+        self.failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            if self._opened is None:
+                return False
+
+            if self.retry_interval is not None and \
+                    time.monotonic() - self._opened >= self.retry_interval:
+                # Let the next attempt through, another failure opens the breaker again
+                self._opened = None
+                return False
+
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self._opened = time.monotonic()
+
+
+def request_kind(kwargs, response):
+    """Requests whose latencies are comparable: file downloads, revalidated pages and pages"""
+    if kwargs.get("stream"):
+        return "download"
+
+    if response.status_code == 304:
+        return "revalidated"
+
+    return "page"
+
+
+def backoff(attempt):
+    """Waits before the given retry, exponentially longer for every attempt, with full jitter so
+    that concurrent retries don't hit the server at once"""
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+    with stats.phase("wait"):
+        time.sleep(delay)
+
+
+class ConnectionPool(object):
+    """Kept-alive connections, the connection slots and circuit breakers of every host, the
+    bandwidth limit (in bytes per second, 0 is unlimited) and how requests are retried, which can
+    be shared by several sessions (e.g. of different accounts)"""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS_DEFAULT, rate_limit=0,
+                 retries=RETRIES_DEFAULT, timeout=TIMEOUT_DEFAULT, adaptive=True):
+        super(ConnectionPool, self).__init__()
+        self.max_connections = max(1, max_connections)
+        self.adaptive = adaptive
+        self.bandwidth = TokenBucket(rate_limit) if rate_limit else None
+        self.retries = max(0, retries)
+        self.timeout = timeout
+        self._host_breakers = {}
+
+        # Keep as many connections alive as may be used concurrently, so that they are reused
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_connections)
+
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def host_slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = AdaptiveLimit(self.max_connections, self.adaptive)
+
+            return self._host_slots[host]
+
+    def host_breaker(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+
+        with self._host_slots_lock:
+            if host not in self._host_breakers:
+                self._host_breakers[host] = CircuitBreaker(HOST_MAX_FAILURES, HOST_RETRY_INTERVAL)
+
+            return self._host_breakers[host]
+
+    def throttle(self, amount):
+        if self.bandwidth is not None:
+            self.bandwidth.consume(amount)
+
+    def close(self):
+        self.adapter.close()
+
+
 class Session(object):
+    """Login session with Stud.IP. Requests are sent by the adapter of the connection pool, or
+    by transport (e.g. to record or replay them, see studip_sync.transport)."""
 
-    def __init__(self, plugins=None, base_url=URL_BASEURL_DEFAULT):
+    def __init__(self, plugins=None, base_url=URL_BASEURL_DEFAULT,
+                 max_connections=MAX_CONNECTIONS_DEFAULT, cache=None, pool=None, transport=None):
         super(Session, self).__init__()
+        self._shared_pool = pool is not None
+        self.pool = pool if pool is not None else ConnectionPool(max_connections)
+        self.cache = cache
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": "WeWantFileSync"})
+
+        transport = transport if transport is not None else self.pool.adapter
+        self.session.mount("https://", transport)
+        self.session.mount("http://", transport)
+
+        self._relogin = None
+        self._relogin_lock = threading.Lock()
+        self._login_generation = 0
+        self._security_token = None, None
+        self._local = threading.local()
         self.url = URL(base_url)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.session.__exit__()
+        # A shared pool is closed by its owner
+        if not self._shared_pool:
+            self.session.__exit__()
 
     def set_base_url(self, new_base_url):
         self.url = URL(new_base_url)
 
+    @contextmanager
+    def request(self, method, url, **kwargs):
+        """Performs a request while holding one of the connection slots of the host.
+
+        Transient failures (5xx responses, connection errors and timeouts) are retried with
+        backoff. After too many failed requests, the host is given up for a while and
+        HostUnavailableError is raised right away. If the response shows that the login session
+        expired, it logs in again and retries once.
+        """
+        kwargs.setdefault("timeout", self.pool.timeout)
+        host_slot = self.pool.host_slot(url)
+        host_breaker = self.pool.host_breaker(url)
+
+        attempt = 0
+        while True:
+            if host_breaker.is_open():
+                raise HostUnavailableError("Giving up on {} after {} failed requests".format(
+                    urllib.parse.urlsplit(url).netloc, host_breaker.failures))
+
+            with stats.phase("wait"):
+                host_slot.acquire()
+
+            try:
+                response = self._send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                host_slot.release()
+                if attempt >= self.pool.retries:
+                    host_breaker.failure()
+                    raise
+            except BaseException:
+                # E.g. a failed login or a broken body, the slot must not be lost
+                host_slot.release()
+                raise
+            else:
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+                host_slot.update(response.elapsed.total_seconds(), throttled,
+                                 parsers.extract_retry_after(response.headers)
+                                 if throttled else None,
+                                 request_kind(kwargs, response))
+
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.pool.retries:
+                    break
+
+                self._close_response(response)
+                host_slot.release()
+
+            attempt += 1
+            backoff(attempt)
+
+        try:
+            if response.status_code in RETRY_STATUS_CODES:
+                host_breaker.failure()
+            else:
+                host_breaker.success()
+
+            try:
+                yield response
+            finally:
+                self._close_response(response)
+        finally:
+            host_slot.release()
+
+    def _send(self, method, url, **kwargs):
+        login_generation = self._login_generation
+        response = self.session.request(method, url, **kwargs)
+
+        if self._relogin is not None and self.is_login_page(response, kwargs.get("stream")):
+            self._close_response(response)
+            self.relogin(login_generation)
+            response = self.session.request(method, url, **kwargs)
+
+        return response
+
+    @staticmethod
+    def _close_response(response):
+        response.close()
+
+        # Bytes of the body read from the connection, before decoding
+        try:
+            received = response.raw.tell()
+        except AttributeError:
+            received = 0
+
+        stats.count_request(received)
+
+    def is_login_page(self, response, stream=False):
+        if getattr(self._local, "logging_in", False):
+            return False
+
+        if response.history and response.url.startswith(self.url.login_page().split("?")[0]):
+            return True
+
+        # The body of streamed downloads is only inspected via redirects
+        if stream or "text/html" not in response.headers.get("Content-Type", ""):
+            return False
+
+        return 'name="loginname"' in response.text
+
+    def relogin(self, login_generation):
+        with self._relogin_lock:
+            # Another thread logged in again already
+            if login_generation != self._login_generation:
+                return
+
+            print("Session expired, logging in again...")
+            self._local.logging_in = True
+            try:
+                self._relogin()
+            finally:
+                self._local.logging_in = False
+
+            self._login_generation += 1
+
+    def enable_relogin(self, relogin):
+        """Sets the function which is called to log in again if the session expires"""
+        self._relogin = relogin
+
+    def get_parsed(self, url, parse, params=None, check_response=None, variant=""):
+        """Performs a GET request and returns the parsed response. If the response cache holds an
+        entry for this request, it is revalidated and its parsed result reused on 304."""
+        entry = None
+        headers = {}
+
+        if self.cache is not None:
+            entry = self.cache.get(url, params, variant)
+            if entry is not None:
+                headers = self.cache.validators(entry)
+
+        with self.request("GET", url, params=params, headers=headers) as response:
+            if entry is not None and response.status_code == 304:
+                return entry["result"]
+
+            if check_response is not None:
+                check_response(response)
+
+            text = response.text
+
+        # After the connection slot was released, other requests to the host don't wait for it
+        with stats.phase("parse"):
+            result = parse(text)
+
+        if self.cache is not None:
+            self.cache.put(url, params, response.headers, result, variant)
+
+        return result
+
     def login(self, auth_type, auth_type_data, username, password):
         auth = AUTHENTICATION_TYPES[auth_type]
-        auth.login(self, username, password, auth_type_data)
+
+        self._local.logging_in = True
+        try:
+            auth.login(self, username, password, auth_type_data)
+        finally:
+            self._local.logging_in = False
+
+    def is_logged_in(self, auth_type):
+        auth = AUTHENTICATION_TYPES[auth_type]
+
+        self._local.logging_in = True
+        try:
+            return auth.is_logged_in(self)
+        finally:
+            self._local.logging_in = False
+
+    def save_cookies(self, path):
+        """Saves the cookies of the login session, only readable by the current user"""
+        cookies = [{
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "secure": cookie.secure,
+            "expires": cookie.expires
+        } for cookie in self.session.cookies]
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        temp_path = path + ".tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as cookies_file:
+            os.fchmod(cookies_file.fileno(), 0o600)
+            json.dump({"base_url": self.url.base_url, "cookies": cookies}, cookies_file)
+
+        os.replace(temp_path, path)
+
+    def load_cookies(self, path):
+        """Loads the cookies saved by save_cookies. Returns False if there are none for the
+        current base url."""
+        try:
+            with open(path) as cookies_file:
+                data = json.load(cookies_file)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("base_url") != self.url.base_url or not data.get("cookies"):
+            return False
+
+        for cookie in data["cookies"]:
+            self.session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+
+        return True
 
     def get_courses(self, only_recent_semester=False):
-        with self.session.get(self.url.courses()) as response:
+        def check_response(response):
             if not response.ok:
                 raise SessionError("Failed to get courses")
 
-            return parsers.extract_courses(response.text, only_recent_semester)
+        return self.get_parsed(
+            self.url.courses(),
+            lambda html: list(parsers.extract_courses(html, only_recent_semester)),
+            check_response=check_response, variant="recent" if only_recent_semester else "")
 
     def check_course_new_files(self, course_id, last_sync):
+        last_edit = self.get_course_last_edit(course_id)
+        return last_edit == 0 or last_edit > last_sync
+
+    def get_course_last_edit(self, course_id):
+        return self.get_files_flat(course_id)[0]
+
+    def get_files_flat(self, course_id):
+        """Returns the last edit of any file in the course and the data-files of the flat view,
+        or None instead of the data-files if they can't be extracted"""
         params = {"cid": course_id}
 
-        with self.session.get(self.url.files_flat(), params=params) as response:
+        def check_response(response):
             if not response.ok:
                 if response.status_code == 403 and "Documents" in response.text:
                     raise MissingFeatureError("This course has no files")
                 else:
                     raise DownloadError("Cannot access course files_flat page")
-            last_edit = parsers.extract_files_flat_last_edit(response.text)
+
+        last_edit, form_data_files = self.get_parsed(self.url.files_flat(),
+                                                     parsers.extract_files_flat, params,
+                                                     check_response)
 
         if last_edit == 0:
             print("\tLast file edit couldn't be detected!")
         else:
             print("\tLast file edit: {}".format(
                 time.strftime("%d.%m.%Y %H:%M", time.gmtime(last_edit))))
-        return last_edit == 0 or last_edit > last_sync
+        return last_edit, form_data_files
 
-    def download(self, course_id, workdir, sync_only=None):
+    def download(self, course_id, path, sync_only=None, folder_id=None):
+        """Downloads the files with the ids in sync_only (or the whole folder) of the given folder
+        (or the root folder) as a single ZIP archive to path"""
         params = {"cid": course_id}
 
-        with self.session.get(self.url.files_main(), params=params) as response:
-            if not response.ok:
-                raise DownloadError("Cannot access course files page")
-            folder_id = parsers.extract_parent_folder_id(response.text)
-            csrf_token = parsers.extract_csrf_token(response.text)
+        # The security token is valid for the whole login session
+        csrf_token, login_generation = self._security_token
+        if not folder_id or login_generation != self._login_generation:
+            login_generation = self._login_generation
+
+            with self.request("GET", self.url.files_main(), params=params) as response:
+                if not response.ok:
+                    raise DownloadError("Cannot access course files page")
+                soup = parsers.parse_html(response.text)
+                if not folder_id:
+                    folder_id = parsers.extract_parent_folder_id(response.text, soup)
+                csrf_token = parsers.extract_csrf_token(response.text, soup)
+
+            self._security_token = csrf_token, login_generation
 
         download_url = self.url.bulk_download(folder_id)
         data = {
@@ -121,21 +640,77 @@ class Session(object):
             "download": 1
         }
 
-        with self.session.post(download_url, params=params, data=data, stream=True) as response:
+        with stats.phase("transfer"), \
+                self.request("POST", download_url, params=params, data=data,
+                             stream=True) as response:
             if not response.ok:
                 raise DownloadError("Cannot download course files")
-            path = os.path.join(workdir, course_id)
-            with open(path, "wb") as download_file:
-                shutil.copyfileobj(response.raw, download_file)
-                return path
 
-    def download_file(self, download_url, tempfile):
-        with self.session.post(download_url, stream=True) as response:
+            try:
+                with open(path, "wb") as download_file:
+                    for chunk in iter(lambda: response.raw.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        self.pool.throttle(len(chunk))
+                        download_file.write(chunk)
+            except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                raise DownloadError("Connection lost while downloading files: {}".format(e))
+
+            return path
+
+    def download_file(self, download_url, tempfile, offset=0, attempt=0):
+        """Downloads the file to tempfile and returns the SHA-256 hex digest of its content.
+
+        If offset is given, the first offset bytes of tempfile are kept and only the rest of the
+        file is requested, as long as the server supports range requests. If the connection is
+        lost, the download is resumed this way.
+        """
+        checksum = hashlib.sha256()
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+
+        with stats.phase("transfer"), \
+                self.request("POST", download_url, headers=headers, stream=True) as response:
+            if offset and response.status_code == 416:
+                # The partial file doesn't fit the file on the server anymore
+                return self.download_file(download_url, tempfile)
+
             if not response.ok:
                 raise DownloadError("Cannot download file")
 
-            with open(tempfile, "wb") as file:
-                shutil.copyfileobj(response.raw, file)
+            mode = "wb"
+            if offset and response.status_code == 206:
+                try:
+                    range_start, _, _ = parsers.extract_content_range(response.headers)
+                except parsers.ParserError:
+                    range_start = None
+
+                if range_start == offset:
+                    mode = "ab"
+                    with stats.phase("files"), open(tempfile, "rb") as file:
+                        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                            checksum.update(chunk)
+                else:
+                    # Can't resume, so the whole file is downloaded again
+                    return self.download_file(download_url, tempfile)
+
+            connection_error = None
+            try:
+                with open(tempfile, mode) as file:
+                    for chunk in iter(lambda: response.raw.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        self.pool.throttle(len(chunk))
+                        checksum.update(chunk)
+                        file.write(chunk)
+            except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                connection_error = e
+
+        if connection_error is not None:
+            if attempt >= self.pool.retries:
+                raise ConnectionLostError("Connection lost while downloading file: {}".format(
+                    connection_error))
+
+            backoff(attempt + 1)
+            return self.download_file(download_url, tempfile, os.path.getsize(tempfile),
+                                      attempt + 1)
+
+        return checksum.hexdigest()
 
     def get_files_index(self, course_id, folder_id=None):
         params = {"cid": course_id}
@@ -145,7 +720,7 @@ class Session(object):
         else:
             url = self.url.files_main()
 
-        with self.session.get(url, params=params) as response:
+        def check_response(response):
             if not response.ok:
                 if response.status_code == 403 and "Documents" in response.text:
                     raise MissingFeatureError("This course has no files")
@@ -154,4 +729,7 @@ class Session(object):
                         "You are missing the required pemissions to view this folder")
                 else:
                     raise DownloadError("Cannot access course files/files_index page")
-            return parsers.extract_files_index_data(response.text)
+
+        form_data_files, form_data_folders = self.get_parsed(
+            url, parsers.extract_files_index_data, params, check_response)
+        return form_data_files, form_data_folders
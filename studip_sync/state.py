@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+
+
+class SyncState(object):
+    """Change watermarks of every course and folder, stored separately from the config file.
+
+    A watermark is the time at which a course or a folder was last confirmed to be up to date.
+    A read-only state is never saved (e.g. while planning a sync).
+    """
+
+    def __init__(self, path, read_only=False):
+        super(SyncState, self).__init__()
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+
+        try:
+            with open(path) as state_file:
+                self.state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            self.state = {}
+
+        self.state.setdefault("courses", {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+
+    def _course(self, course_id):
+        return self.state["courses"].setdefault(course_id, {"synced": 0, "folders": {}})
+
+    def course_watermark(self, course_id):
+        """Returns the watermark of the course or None if the course is unknown"""
+        with self._lock:
+            return self.state["courses"].get(course_id, {}).get("synced")
+
+    def course_last_edit(self, course_id):
+        """Returns the time of the last change of any file in the course seen by a sync or 0"""
+        with self._lock:
+            return self.state["courses"].get(course_id, {}).get("last_edit", 0)
+
+    def update_course(self, course_id, synced, last_edit=0):
+        with self._lock:
+            course = self._course(course_id)
+            course["synced"] = synced
+
+            if last_edit:
+                course["last_edit"] = last_edit
+
+    def reset_course(self, course_id):
+        """Resets the watermarks of the course and its folders, so that the next sync checks all
+        of its files. The known folders are kept."""
+        with self._lock:
+            course = self.state["courses"].get(course_id)
+            if course is None:
+                return
+
+            course["synced"] = 0
+            for folder in course["folders"].values():
+                folder["synced"] = 0
+
+    def folder(self, course_id, folder_id):
+        """Returns the watermark and the known subfolders of a folder or None"""
+        with self._lock:
+            course = self.state["courses"].get(course_id, {})
+            folder = course.get("folders", {}).get(folder_id or "")
+
+            if folder is None:
+                return None
+
+            return folder["synced"], list(folder["folders"])
+
+    def update_folder(self, course_id, folder_id, synced, subfolders):
+        with self._lock:
+            self._course(course_id)["folders"][folder_id or ""] = {
+                "synced": synced,
+                "folders": [{"id": f["id"], "name": f["name"]} for f in subfolders]
+            }
+
+    def update_root_folder(self, course_id, root_folder_id):
+        with self._lock:
+            self._course(course_id)["root"] = root_folder_id
+
+    def folder_tree(self, course_id, listings=None):
+        """Returns the parent id and the relative path of all known folders of a course by their
+        id. listings maps folder ids to subfolders which were listed since and replace the known
+        ones. The root folder has no parent."""
+        listings = listings or {}
+
+        with self._lock:
+            course = self.state["courses"].get(course_id, {})
+            folders = course.get("folders", {})
+
+            if "" not in folders:
+                return {}
+
+            tree = {"": (None, "")}
+            stack = [""]
+            while stack:
+                folder_id = stack.pop()
+                subfolders = listings.get(folder_id)
+                if subfolders is None:
+                    subfolders = folders.get(folder_id, {}).get("folders", [])
+
+                for subfolder in subfolders:
+                    if subfolder["id"] not in tree:
+                        tree[subfolder["id"]] = (folder_id, os.path.join(tree[folder_id][1],
+                                                                         subfolder["name"]))
+                        stack.append(subfolder["id"])
+
+            # Files refer to the root folder by its id
+            root = course.get("root")
+            if root:
+                tree[root] = tree.pop("")
+                for folder_id, (parent, path) in tree.items():
+                    if parent == "":
+                        tree[folder_id] = (root, path)
+
+            return tree
+
+    def save(self):
+        if self.read_only:
+            return
+
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as state_file:
+                json.dump(self.state, state_file)
+
+            os.replace(temp_path, self.path)
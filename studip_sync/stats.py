@@ -0,0 +1,221 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+_local = threading.local()
+_stats = None
+
+
+class Stats(object):
+    """Time spent in every phase of a sync, the number of requests and the received bytes, in
+    total and per course.
+
+    The time of a phase doesn't include the time of the phases nested in it, e.g. parsing a
+    folder listing isn't counted as crawling. Phases run concurrently, so their sum may exceed
+    the wall time.
+    """
+
+    def __init__(self, profile=False):
+        super(Stats, self).__init__()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._total = self._new_entry()
+        self._courses = {}
+        self.profiles = [] if profile else None
+
+    @staticmethod
+    def _new_entry():
+        return {"requests": 0, "bytes_received": 0, "phases": {}}
+
+    def _entries(self, course_id):
+        if course_id is None:
+            return [self._total]
+
+        return [self._total, self._courses[course_id]]
+
+    def add_course(self, course_id, **info):
+        with self._lock:
+            if course_id not in self._courses:
+                self._courses[course_id] = dict(info, wall_time=0, **self._new_entry())
+
+    def add_course_time(self, course_id, seconds):
+        with self._lock:
+            self._courses[course_id]["wall_time"] += seconds
+
+    def add_time(self, course_id, phase, seconds):
+        with self._lock:
+            for entry in self._entries(course_id):
+                entry["phases"][phase] = entry["phases"].get(phase, 0) + seconds
+
+    def add_request(self, course_id, received):
+        with self._lock:
+            for entry in self._entries(course_id):
+                entry["requests"] += 1
+                entry["bytes_received"] += received
+
+    def profile(self, func, *args, **kwargs):
+        """Runs func with a profiler of its own if profiling is enabled"""
+        if self.profiles is None:
+            return func(*args, **kwargs)
+
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Since Python 3.12 the profiler of the main thread covers all threads
+            return func(*args, **kwargs)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self.profiles.append(profiler)
+
+    def summary(self):
+        def rounded(entry):
+            entry = dict(entry)
+            entry["phases"] = {phase: round(seconds, 3)
+                               for phase, seconds in sorted(entry["phases"].items())}
+            if "wall_time" in entry:
+                entry["wall_time"] = round(entry["wall_time"], 3)
+            return entry
+
+        with self._lock:
+            summary = rounded(self._total)
+            summary["wall_time"] = round(time.perf_counter() - self._started, 3)
+            summary["courses"] = {course_id: rounded(entry)
+                                  for course_id, entry in self._courses.items()}
+
+        return summary
+
+    def write_summary(self, path):
+        if path == "-":
+            print(json.dumps(self.summary(), indent=4))
+            return
+
+        with open(path, "w") as summary_file:
+            json.dump(self.summary(), summary_file, indent=4)
+
+    def dump_profile(self, path):
+        import pstats
+
+        with self._lock:
+            profiles = list(self.profiles)
+
+        pstats.Stats(*profiles).dump_stats(path)
+
+
+@contextmanager
+def collect(stats_path=None, profile_path=None):
+    """Collects the statistics of everything run in this block. When leaving it, the summary is
+    written to stats_path as JSON ("-" for stdout) and the profile to profile_path in the
+    format of the pstats module."""
+    global _stats
+
+    if stats_path is None and profile_path is None:
+        yield None
+        return
+
+    stats = Stats(profile=profile_path is not None)
+    _stats = stats
+
+    try:
+        if profile_path is not None:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield stats
+            finally:
+                profiler.disable()
+                stats.profiles.append(profiler)
+        else:
+            yield stats
+    finally:
+        _stats = None
+
+        if stats_path is not None:
+            stats.write_summary(stats_path)
+
+        if profile_path is not None:
+            stats.dump_profile(profile_path)
+
+
+@contextmanager
+def course(course_id, **info):
+    """Attributes everything the current thread does in this block to the given course"""
+    stats = _stats
+    if stats is None:
+        yield
+        return
+
+    stats.add_course(course_id, **info)
+    previous = getattr(_local, "course", None)
+    _local.course = course_id
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        stats.add_course_time(course_id, time.perf_counter() - start)
+        _local.course = previous
+
+
+@contextmanager
+def phase(name):
+    """Measures the time spent in this block, minus the time spent in nested phases"""
+    stats = _stats
+    if stats is None:
+        yield
+        return
+
+    parent = getattr(_local, "phase", None)
+    nested = [0.0]
+    _local.phase = nested
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.phase = parent
+
+        if parent is not None:
+            parent[0] += elapsed
+
+        stats.add_time(getattr(_local, "course", None), name, elapsed - nested[0])
+
+
+def count_request(received):
+    stats = _stats
+    if stats is not None:
+        stats.add_request(getattr(_local, "course", None), received)
+
+
+def bind(func):
+    """Wraps func so that its statistics are attributed to the course of the calling thread,
+    even if it is executed by another thread"""
+    course_id = getattr(_local, "course", None)
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        stats = _stats
+        if stats is None:
+            return func(*args, **kwargs)
+
+        previous = getattr(_local, "course", None), getattr(_local, "phase", None)
+        _local.course = course_id
+        _local.phase = None
+
+        try:
+            return stats.profile(func, *args, **kwargs)
+        finally:
+            _local.course, _local.phase = previous
+
+    return inner
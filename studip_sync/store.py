@@ -0,0 +1,152 @@
+import errno
+import hashlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from studip_sync.constants import DEDUP_HARDLINK, DEDUP_REFLINK
+
+# ioctl of Linux which makes a file share the data blocks of another one (copy-on-write)
+FICLONE = 0x40049409
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Marks a store to which the files synchronized before deduplication was enabled were added
+STORE_MIGRATED_FILENAME = "migrated"
+
+
+def file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def reflink(source, target):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported")
+
+    with open(source, "rb") as source_file, open(target, "xb") as target_file:
+        try:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            target_file.close()
+            os.remove(target)
+            raise
+
+
+class ObjectStore(object):
+    """Content-addressed store of downloaded files, keyed by their SHA-256 checksum.
+
+    Files with the same content share one object: with hardlinks, all of them are the same file
+    on the disk. With reflinks (on filesystems which support them, e.g. Btrfs or XFS) they are
+    independent files which share their data blocks until one of them is modified, and
+    hardlinks are used if a reflink fails. The store has to be on the same filesystem as the
+    synchronized files.
+    """
+
+    def __init__(self, path, mode=DEDUP_HARDLINK):
+        super(ObjectStore, self).__init__()
+        self.path = path
+        self.mode = mode
+
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def migrated(self):
+        return os.path.exists(os.path.join(self.path, STORE_MIGRATED_FILENAME))
+
+    def mark_migrated(self):
+        with open(os.path.join(self.path, STORE_MIGRATED_FILENAME), "w"):
+            pass
+
+    def object_path(self, checksum):
+        return os.path.join(self.path, checksum[:2], checksum)
+
+    def _link(self, source, target):
+        if self.mode == DEDUP_REFLINK:
+            try:
+                return reflink(source, target)
+            except FileExistsError:
+                raise
+            except OSError:
+                pass
+
+        os.link(source, target)
+
+    def add(self, file_path, checksum):
+        """Stores the file with the given checksum. If the store already has an object with this
+        content, the file is replaced by it. Returns True in that case."""
+        object_path = self.object_path(checksum)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+        try:
+            if os.path.samefile(file_path, object_path):
+                return False
+        except FileNotFoundError:
+            try:
+                self._link(file_path, object_path)
+                return False
+            except FileExistsError:
+                # Another file with this content was stored in the meantime
+                pass
+
+        self.restore(checksum, file_path)
+        return True
+
+    def restore(self, checksum, file_path):
+        """Links the object with the given checksum to file_path, replacing it atomically.
+        Returns False if there is no such object."""
+        object_path = self.object_path(checksum)
+
+        file_path_base, file_path_name = os.path.split(file_path)
+        temp_path = os.path.join(file_path_base, ".{}.link".format(file_path_name))
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+
+        try:
+            self._link(object_path, temp_path)
+        except FileNotFoundError:
+            return False
+
+        # Hardlinks share their modification time, which must not be older than this file
+        os.utime(temp_path)
+        os.replace(temp_path, file_path)
+        return True
+
+    def discard(self, file_path, checksum):
+        """Removes the object with the given checksum if file_path is linked to it"""
+        object_path = self.object_path(checksum)
+
+        try:
+            if os.path.samefile(file_path, object_path):
+                os.remove(object_path)
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self, referenced=()):
+        """Removes the objects which no file links to anymore and whose checksum isn't in
+        referenced. Returns the number and the total size of the removed objects."""
+        referenced = set(referenced)
+        count = 0
+        size = 0
+
+        for prefix in os.scandir(self.path):
+            if not prefix.is_dir():
+                continue
+
+            for entry in os.scandir(prefix.path):
+                stat = entry.stat()
+                if stat.st_nlink > 1 or entry.name in referenced:
+                    continue
+
+                os.remove(entry.path)
+                count += 1
+                size += stat.st_size
+
+        return count, size
@@ -1,91 +1,451 @@
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, \
+    FIRST_COMPLETED
+from contextlib import nullcontext
 from datetime import datetime
+import hashlib
+import json
 import os
-import shutil
-import tempfile
+import signal
+import threading
 import time
+import traceback
 import unicodedata
 import string
+import zipfile
 
-from studip_sync.arg_parser import ARGS
-from studip_sync.config import CONFIG
+from studip_sync import output, stats
+from studip_sync.constants import MAX_CONNECTIONS_DEFAULT, CACHE_DIRNAME, COOKIES_FILENAME, \
+    CRAWL_AUTO, CRAWL_RECURSIVE, POLL_INTERVAL_MIN_DEFAULT, POLL_INTERVAL_MAX_DEFAULT, \
+    COURSE_LIST_INTERVAL, DEDUP_HARDLINK, COURSE_MAX_FAILURES
+from studip_sync.daemon import PollScheduler
+from studip_sync.downloader import DownloadQueue
+from studip_sync.helpers import ConfigError
+from studip_sync.http_cache import ResponseCache
 from studip_sync.logins import LoginError
-from studip_sync.session import Session, DownloadError, MissingFeatureError, \
-    MissingPermissionFolderError
+from studip_sync.local_files import LocalFiles
+from studip_sync.session import Session, SessionError, DownloadError, MissingFeatureError, \
+    MissingPermissionFolderError, CircuitBreaker, DOWNLOAD_CHUNK_SIZE, RESUMABLE_DOWNLOAD_ERRORS
 from studip_sync.parsers import ParserError
+from studip_sync.plan import SyncPlan, REASON_NEW, REASON_CHANGED, REASON_MOVED
+from studip_sync.store import file_checksum
 
 
-class StudIPRSync(object):
+class StudIPRSync(LocalFiles):
+    """Synchronizes the files of one account. The connection pool, the download queue and the
+    executor of the courses may be shared with the syncs of other accounts."""
 
-    def __init__(self):
-        super(StudIPRSync, self).__init__()
-        self.workdir = tempfile.mkdtemp(prefix="studip-sync")
-        self.files_destination_dir = CONFIG.files_destination
+    def __init__(self, config, pool=None, downloads=None, course_executor=None, transport=None):
+        super(StudIPRSync, self).__init__(config)
+        self.pool = pool
+        self.transport = transport
+        self.downloads = downloads
+        self.course_executor = course_executor
 
-        if self.files_destination_dir:
-            os.makedirs(self.files_destination_dir, exist_ok=True)
+    def sync(self, sync_fully=False, sync_recent=False, jobs=1, course_jobs=1, download_jobs=1,
+             max_connections=MAX_CONNECTIONS_DEFAULT, crawl_strategy=CRAWL_AUTO,
+             use_cache=True, bulk=False):
 
-    def sync(self, sync_fully=False, sync_recent=False):
-
-        with Session(base_url=CONFIG.base_url) as session:
-            print("Logging in...")
-            try:
-                session.login(CONFIG.auth_type, CONFIG.auth_type_data, CONFIG.username,
-                              CONFIG.password)
-            except (LoginError, ParserError) as e:
-                print("Login failed!")
-                print(e)
+        with self.open_session(max_connections, use_cache) as session, \
+                self.open_downloads(download_jobs) as downloads, \
+                self.open_manifest() as manifest, self.open_state() as state:
+            if not self.start_session(session):
                 return 1
 
-            print("Downloading course list...")
-
-            try:
-                courses = list(session.get_courses(sync_recent))
-            except (LoginError, ParserError) as e:
-                print("Downloading course list failed!")
-                print(e)
+            courses = self.get_courses(session, sync_recent)
+            if courses is None:
                 return 1
 
             if sync_recent:
                 print("Syncing only the most recent semester!")
 
-            status_code = 0
-            for i in range(0, len(courses)):
-                course = courses[i]
-                print("{}) {}: {}".format(i + 1, course["semester"], course["save_as"]))
+            failed_courses = self.sync_courses(session, downloads, manifest, state, courses,
+                                               sync_fully, jobs, course_jobs, crawl_strategy,
+                                               bulk)
 
-                course_save_as = get_course_save_as(course)
+            if self.store is not None:
+                self.update_store(manifest)
 
-                if self.files_destination_dir:
-                    try:
-                        files_root_dir = os.path.join(self.files_destination_dir, course_save_as)
+        if self.history is not None:
+            self.prune_history()
 
-                        CourseRSync(session, self.workdir, files_root_dir, course,
-                                    sync_fully).download()
-                    except MissingFeatureError:
-                        # Ignore if there are no files
-                        pass
-                    except DownloadError as e:
-                        print("\tDownload of files failed: " + str(e))
-                        status_code = 2
-                        raise e
+        status_code = 0
+        if failed_courses:
+            status_code = 2
+            print("Sync of {} of {} courses failed, the others were synchronized:".format(
+                len(failed_courses), len(courses)))
+            for course, error in failed_courses:
+                print("\t{}: {}: {}".format(course["semester"], course["save_as"], error))
 
         if self.files_destination_dir and status_code == 0:
-            CONFIG.update_last_sync(int(time.time()))
+            self.config.update_last_sync(int(time.time()))
 
         return status_code
 
-    def cleanup(self):
-        shutil.rmtree(self.workdir)
+    def plan(self, plan_path=None, sync_fully=False, sync_recent=False, jobs=1, course_jobs=1,
+             max_connections=MAX_CONNECTIONS_DEFAULT, crawl_strategy=CRAWL_AUTO,
+             use_cache=True):
+        """Crawls all courses and prints the files which a sync would download or move, without
+        changing them. The plan is saved to plan_path to be executed later."""
+        if not self.files_destination_dir:
+            print("Planning a sync needs a destination directory!")
+            return 1
+
+        plan = SyncPlan(self.config.base_url)
+
+        with self.open_session(max_connections, use_cache) as session, \
+                self.open_manifest() as manifest, self.open_state(read_only=True) as state:
+            if not self.start_session(session):
+                return 1
+
+            courses = self.get_courses(session, sync_recent)
+            if courses is None:
+                return 1
+
+            failed_courses = self.sync_courses(session, None, manifest, state, courses,
+                                               sync_fully, jobs, course_jobs, crawl_strategy,
+                                               False, plan)
+
+        print("Plan:")
+        plan.print_summary()
+
+        if plan_path:
+            plan.save(plan_path)
+            print("Saved the plan to {}".format(plan_path))
+
+        if failed_courses:
+            print("Planning of {} of {} courses failed, the plan is incomplete:".format(
+                len(failed_courses), len(courses)))
+            for course, error in failed_courses:
+                print("\t{}: {}: {}".format(course["semester"], course["save_as"], error))
+            return 2
+
+        return 0
+
+    def execute_plan(self, plan_path, download_jobs=1, max_connections=MAX_CONNECTIONS_DEFAULT,
+                     use_cache=True):
+        """Downloads and moves the files of a saved plan. Files which were synchronized since the
+        plan was made are skipped. The courses are checked again by the next sync."""
+        if not self.files_destination_dir:
+            print("Executing a plan needs a destination directory!")
+            return 1
+
+        try:
+            plan = SyncPlan.load(plan_path)
+        except (OSError, ValueError, KeyError) as e:
+            print("Loading the plan failed: {}".format(e))
+            return 1
+
+        if plan.base_url != self.config.base_url:
+            print("The plan was made for {}, not for {}!".format(plan.base_url,
+                                                               self.config.base_url))
+            return 1
+
+        print("Executing the plan of {}: {} files ({:.1f} MB)".format(
+            time.strftime("%d.%m.%Y %H:%M", time.localtime(plan.created)), len(plan.files),
+            plan.download_size / 1024 / 1024))
+
+        with self.open_session(max_connections, use_cache) as session, \
+                self.open_downloads(download_jobs) as downloads, self.open_manifest() as manifest:
+            if not self.start_session(session):
+                return 1
+
+            course_syncs = {}
+            futures = []
+
+            for entry in plan.files:
+                course_sync = course_syncs.get(entry["course_id"])
+                if course_sync is None:
+                    course = {"course_id": entry["course_id"], "save_as": entry["course"],
+                              "semester_id": entry.get("semester_id", 0)}
+                    course_sync = CourseRSync(session, entry["root_folder"], course, False,
+                                              downloads=downloads, manifest=manifest,
+                                              store=self.store, history=self.history)
+                    course_syncs[entry["course_id"]] = course_sync
+
+                # Moves have no priority, so they come first: they are cheap and may free the
+                # paths of other files
+                file_data = entry["file"] if entry["reason"] != REASON_MOVED else None
+                futures.append((entry, course_sync.queue(course_sync.download_file,
+                                                         entry["file"], entry["folder"], [],
+                                                         file_data=file_data)))
+
+            failed_entries = []
+            for entry, future in futures:
+                try:
+                    future.result()
+                except (SessionError, ParserError, OSError) as e:
+                    failed_entries.append((entry, e))
+
+            if self.store is not None:
+                self.update_store(manifest)
+
+        if self.history is not None:
+            self.prune_history()
+
+        if failed_entries:
+            print("{} of {} files of the plan failed:".format(len(failed_entries),
+                                                              len(plan.files)))
+            for entry, error in failed_entries:
+                print("\t{}: {}".format(entry["path"], error))
+            return 2
+
+        return 0
+
+    def daemon(self, sync_recent=False, jobs=1, course_jobs=1, download_jobs=1,
+               max_connections=MAX_CONNECTIONS_DEFAULT, crawl_strategy=CRAWL_AUTO,
+               use_cache=True, bulk=False, poll_interval_min=POLL_INTERVAL_MIN_DEFAULT,
+               poll_interval_max=POLL_INTERVAL_MAX_DEFAULT):
+        """Keeps the login session and checks every course for new files when it is due,
+        until it is interrupted or terminated"""
+        if not self.files_destination_dir:
+            print("The daemon mode needs a destination directory!")
+            return 1
+
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+
+        with self.open_session(max_connections, use_cache) as session, \
+                self.open_downloads(download_jobs) as downloads, \
+                self.open_manifest() as manifest, self.open_state() as state:
+            if not self.start_session(session):
+                return 1
+
+            scheduler = PollScheduler(state, poll_interval_min, poll_interval_max)
+            courses_updated = None
+
+            try:
+                while not stopped.is_set():
+                    now = time.time()
+                    if courses_updated is None or now - courses_updated >= COURSE_LIST_INTERVAL:
+                        courses = self.get_courses(session, sync_recent)
+                        if courses is not None:
+                            scheduler.update_courses(courses, now)
+                            courses_updated = now
+
+                    courses = scheduler.due(now)
+                    if courses:
+                        print("{}: Checking {} of {} courses...".format(
+                            time.strftime("%d.%m.%Y %H:%M"), len(courses), len(scheduler)))
+
+                        failed_courses = self.sync_courses(session, downloads, manifest, state,
+                                                           courses, False, jobs, course_jobs,
+                                                           crawl_strategy, bulk)
+                        failed_course_ids = {course["course_id"]
+                                             for course, _ in failed_courses}
+
+                        for course in courses:
+                            scheduler.reschedule(course, time.time(),
+                                                 course["course_id"] in failed_course_ids)
+
+                        manifest.commit()
+
+                        if self.history is not None:
+                            self.prune_history()
+
+                    # Wake up for the next due course, or to retry fetching the course list
+                    next_check = scheduler.next_check()
+                    if next_check is None or courses_updated is None:
+                        timeout = poll_interval_min
+                    else:
+                        timeout = min(next_check, courses_updated + COURSE_LIST_INTERVAL) - \
+                                  time.time()
+
+                    stopped.wait(max(0, timeout))
+            except KeyboardInterrupt:
+                pass
+
+        print("Daemon stopped")
+        return 0
+
+    def update_store(self, manifest):
+        """Adds the files which were synchronized before deduplication was enabled (once) and the
+        files which this sync found on the disk to the store, and removes the objects which
+        aren't used anymore"""
+        migrate = self.store.mode == DEDUP_HARDLINK
+        # Only the first sync with a store checks every file, later ones the changed files
+        first = not self.store.migrated
+        failed = False
+        deduplicated = 0
+
+        if not migrate:
+            entries = []
+        elif first:
+            entries = manifest.entries()
+        else:
+            entries = [entry for entry in map(manifest.get, sorted(manifest.changed)) if entry]
+
+        with stats.phase("files"):
+            for entry in entries:
+                try:
+                    stat = os.stat(entry["path"])
+                except OSError:
+                    continue
+
+                # Downloaded files were added to the store already
+                if stat.st_nlink > 1 or stat.st_size != entry["size"]:
+                    continue
+
+                checksum = entry["checksum"]
+
+                try:
+                    # A file without a checksum (or any file on the first sync, which may have
+                    # been modified locally) is read once
+                    if first or not checksum:
+                        local_checksum = file_checksum(entry["path"])
+                        if checksum and local_checksum != checksum:
+                            # Modified locally
+                            continue
+
+                        checksum = local_checksum
+                        manifest.update_checksum(entry["file_id"], checksum)
+
+                    if self.store.add(entry["path"], checksum):
+                        deduplicated += 1
+                except OSError as e:
+                    print("Adding files to the store failed: {}".format(e))
+                    failed = True
+                    break
+
+            if first and not failed:
+                self.store.mark_migrated()
+
+            # Objects are only left unused by files which were replaced, moved or removed
+            count, size = 0, 0
+            if first or manifest.changed:
+                count, size = self.store.collect_garbage(manifest.checksums())
+
+        if deduplicated:
+            print("Deduplicated {} existing files".format(deduplicated))
+
+        if count:
+            print("Removed {} unused files ({} bytes) from the store".format(count, size))
+
+    def open_session(self, max_connections, use_cache):
+        cache = None
+        if use_cache:
+            cache = ResponseCache(os.path.join(self.config.config_dir, CACHE_DIRNAME))
+
+        return Session(base_url=self.config.base_url, max_connections=max_connections,
+                       cache=cache, pool=self.pool, transport=self.transport)
+
+    def open_downloads(self, download_jobs):
+        if self.downloads is not None:
+            return nullcontext(self.downloads)
 
-    def __enter__(self):
-        return self
+        return DownloadQueue(download_jobs)
+
+    def open_course_executor(self, course_jobs):
+        if self.course_executor is not None:
+            return nullcontext(self.course_executor)
+
+        return ThreadPoolExecutor(max_workers=max(1, course_jobs))
+
+    def start_session(self, session):
+        print("Logging in...")
+        try:
+            self.login(session)
+        except (LoginError, ParserError, ConfigError) as e:
+            print("Login failed!")
+            print(e)
+            return False
+
+        session.enable_relogin(lambda: self.login(session, reuse_session=False))
+        return True
+
+    @staticmethod
+    def get_courses(session, sync_recent):
+        print("Downloading course list...")
+
+        try:
+            with stats.phase("courses"):
+                return list(session.get_courses(sync_recent))
+        except (LoginError, ParserError, SessionError, OSError) as e:
+            print("Downloading course list failed!")
+            print(e)
+            return None
+
+    def sync_courses(self, session, downloads, manifest, state, courses, sync_fully, jobs,
+                     course_jobs, crawl_strategy, bulk, plan=None):
+        """Synchronizes the courses and returns the failed ones together with their error. With a
+        plan, the files are only added to it instead of being synchronized."""
+        # Every course is an independent job, its output is buffered and printed at once
+        with self.open_course_executor(course_jobs) as executor:
+            futures = [
+                executor.submit(stats.bind(output.bind(self.sync_course)), session, downloads,
+                                manifest, state, i, course, sync_fully, jobs, crawl_strategy,
+                                bulk, plan)
+                for i, course in enumerate(courses)
+            ]
+
+            failed_courses = []
+            for future in as_completed(futures):
+                course, error = future.result()
+                if error is not None:
+                    failed_courses.append((course, error))
+
+        return failed_courses
+
+    def login(self, session, reuse_session=True):
+        cookies_path = os.path.join(self.config.config_dir, COOKIES_FILENAME)
+
+        with stats.phase("login"):
+            if reuse_session and session.load_cookies(cookies_path):
+                if session.is_logged_in(self.config.auth_type):
+                    print("Reusing the login session of the last sync")
+                    return
+
+                session.session.cookies.clear()
+
+            session.login(self.config.auth_type, self.config.auth_type_data,
+                          self.config.username, self.config.password)
+            session.save_cookies(cookies_path)
+
+    def sync_course(self, session, downloads, manifest, state, i, course, sync_fully, jobs,
+                    crawl_strategy=CRAWL_AUTO, bulk=False, plan=None):
+        with output.buffered(), stats.course(course["course_id"], name=course["save_as"],
+                                             semester=course["semester"]):
+            print("{}) {}: {}".format(i + 1, course["semester"], course["save_as"]))
+
+            if not self.files_destination_dir:
+                return course, None
+
+            course_save_as = get_course_save_as(course, self.config.use_new_file_structure)
+
+            try:
+                files_root_dir = os.path.join(self.files_destination_dir, course_save_as)
+
+                CourseRSync(session, files_root_dir, course, sync_fully, jobs, downloads,
+                            manifest, state, crawl_strategy, bulk,
+                            self.config.last_sync, self.store, plan, self.history).download()
+            except MissingFeatureError:
+                # Ignore if there are no files
+                pass
+            except DownloadError as e:
+                print("\tDownload of files failed: " + str(e))
+                return course, e
+            except (SessionError, ParserError, OSError) as e:
+                print("\tSync of course failed: " + str(e))
+                return course, e
+            except Exception as e:
+                # An unexpected error (e.g. a page in an unknown format) only stops this course
+                print("\tSync of course {} failed unexpectedly: {!r}".format(course["save_as"], e))
+                output.debug(traceback.format_exc())
+                return course, e
+            finally:
+                # Persist the watermarks of this course right away, even after a failure. A plan
+                # leaves them as they are.
+                if state is not None and plan is None:
+                    state.save()
+
+            return course, None
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.cleanup()
 
 
 UNICODE_NORMALIZE_MODE = "NFKC"
 
+# Minimum number of new files in a folder to download them as one archive
+BULK_MIN_FILES = 3
+
 
 def check_and_cleanup_form_data(form_data_files, form_data_folders):
     form_data_files_new = []
@@ -98,8 +458,7 @@ def check_and_cleanup_form_data(form_data_files, form_data_folders):
             # TODO: support links by saving them as .url files
             if "size" not in form_data or form_data["size"] is None or (
                 "icon" in form_data and form_data["icon"] == "link-extern"):
-                if ARGS.v:
-                    print("[Debug] " + str(form_data))
+                output.debug(str(form_data))
                 log("Found unsupported file: {}".format(form_data["name"]))
                 continue
 
@@ -108,6 +467,9 @@ def check_and_cleanup_form_data(form_data_files, form_data_folders):
                     "/", "--"), "id": form_id, "size": int(form_data["size"]),
                 "chdate": int(form_data["chdate"]), "download_url": form_data["download_url"]}
 
+            if form_data.get("folder_id"):
+                new_file_data["folder_id"] = form_data["folder_id"]
+
             form_data_files_new.append(new_file_data)
         except Exception as e:
             print(form_data)
@@ -139,34 +501,120 @@ def log(message, flush=False):
         print("\t\t" + message)
 
 
-def is_file_new(file, file_path):
+def is_file_new(file, file_path, verbose=True):
     if not file["size"]:
         # If there is no size, skip this file, since it can't be downloaded
         return False
 
     if not os.path.exists(file_path):
-        log("File changed: new: {}".format(file_path))
+        if verbose:
+            log("File changed: new: {}".format(file_path))
         return True
 
     file_time = int(os.path.getmtime(file_path))
 
     chdate = file["chdate"]
     if chdate > file_time:
-        log("File changed: time: {} - {} : {}".format(chdate, file_time, file_path))
+        if verbose:
+            log("File changed: time: {} - {} : {}".format(chdate, file_time, file_path))
         return True
 
     file_size = os.path.getsize(file_path)
 
     size = file["size"]
     if not size == file_size:
-        log("File changed: size: {} - {} : {}".format(size, file_size, file_path))
+        if verbose:
+            log("File changed: size: {} - {} : {}".format(size, file_size, file_path))
         return True
 
     return False
 
 
-def get_course_save_as(course):
-    if CONFIG.use_new_file_structure:
+def raise_failures(downloads):
+    """Raises the failure of a single download, or a summary if several of them failed"""
+    errors = [future.exception() for future in downloads
+              if not future.cancelled() and future.exception() is not None]
+
+    for error in errors:
+        if not isinstance(error, Exception):
+            raise error
+
+    if len(errors) == 1:
+        raise errors[0]
+
+    if errors:
+        raise DownloadError("{} of {} downloads failed, the first one: {}".format(
+            len(errors), len(downloads), errors[0])) from errors[0]
+
+
+def get_partial_file_path(file_path, file_id):
+    # Named by the id only, so that the longest valid file names still fit
+    return os.path.join(os.path.dirname(file_path), ".{}.part".format(file_id))
+
+
+class PartialFile(object):
+    """Partially downloaded file, whose metadata is stored next to it to resume the download"""
+
+    def __init__(self, path, file_data):
+        super(PartialFile, self).__init__()
+        self.path = path
+        self.metadata_path = path + ".json"
+        self.metadata = {"id": file_data["id"], "size": file_data["size"],
+                         "chdate": file_data["chdate"]}
+
+    def resume_offset(self):
+        """Returns the number of bytes which are already downloaded and can be kept"""
+        try:
+            with open(self.metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+            offset = os.path.getsize(self.path)
+        except (OSError, ValueError):
+            metadata = None
+            offset = 0
+
+        # Start from scratch if the file changed on Stud.IP in the meantime
+        if metadata != self.metadata or offset >= self.metadata["size"]:
+            offset = 0
+
+        with open(self.metadata_path, "w") as metadata_file:
+            json.dump(self.metadata, metadata_file)
+
+        return offset
+
+    def complete(self):
+        if os.path.exists(self.metadata_path):
+            os.remove(self.metadata_path)
+
+    def remove(self):
+        self.complete()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def install_file(source_file, file_path, history=None, file_id=None):
+    """Moves source_file to file_path atomically. The previous version is saved to the history,
+    or kept as .old file without one."""
+    file_path_base, file_path_name = os.path.split(file_path)
+
+    if os.path.exists(file_path) and history is not None:
+        history.add(file_path, file_id)
+    elif os.path.exists(file_path):
+        timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
+        suffix = "_" + timestr + ".old"
+        new_file_path = os.path.join(file_path_base, file_path_name + suffix)
+
+        # A hardlink keeps the file at its path until it is replaced
+        try:
+            os.link(file_path, new_file_path)
+        except OSError:
+            os.rename(file_path, new_file_path)
+
+    os.replace(source_file, file_path)
+
+
+def get_course_save_as(course, use_new_file_structure=False):
+    if use_new_file_structure:
         save_as_semester = course["semester"].replace("/", "--")
         save_as_semester = "{} - {}".format(course["semester_id"], save_as_semester)
 
@@ -177,73 +625,548 @@ def get_course_save_as(course):
 
 class CourseRSync:
 
-    def __init__(self, session, workdir, root_folder, course, sync_fully):
+    def __init__(self, session, root_folder, course, sync_fully, jobs=1,
+                 downloads=None, manifest=None, state=None, crawl_strategy=CRAWL_AUTO,
+                 bulk=False, config_last_sync=0, store=None, plan=None, history=None):
         self.session = session
-        self.workdir = workdir
+        self.downloads = downloads
+        self.manifest = manifest
+        self.state = state
         self.course_id = course["course_id"]
         self.course_save_as = course["save_as"]
         self.root_folder = root_folder
         self.sync_fully = sync_fully
+        self.jobs = max(1, jobs)
+        self.crawl_strategy = crawl_strategy
+        self.bulk = bulk
+        self.config_last_sync = config_last_sync
+        self.store = store
+        self.plan = plan
+        self.history = history
+        self.course = course
+        self.last_edit = 0
+        self.form_data_files_flat = None
+        # Downloads of this course are given up after too many consecutive failures
+        self.breaker = CircuitBreaker(COURSE_MAX_FAILURES)
 
     def download(self):
+        # A plan doesn't synchronize anything, so the watermarks must stay as they are
+        sync_started = int(time.time()) if self.plan is None else None
+
         if self.course_has_new_files(self.sync_fully):
             print("\tSyncing files...")
-            self.download_recursive()
+            if not self.download_flat(sync_started):
+                self.download_recursive(sync_started)
         else:
             print("\tSkipping this course...")
 
+        if self.state is not None and sync_started is not None:
+            self.state.update_course(self.course_id, sync_started, self.last_edit)
+
     def course_has_new_files(self, sync_fully=False):
         if sync_fully:
             return True
 
-        return self.session.check_course_new_files(self.course_id, CONFIG.last_sync)
+        with stats.phase("check"):
+            self.last_edit, self.form_data_files_flat = self.session.get_files_flat(
+                self.course_id)
+
+        return self.last_edit == 0 or self.last_edit > self.last_sync()
+
+    def last_sync(self):
+        if self.state is not None:
+            course_watermark = self.state.course_watermark(self.course_id)
+            if course_watermark is not None:
+                return course_watermark
+
+        return self.config_last_sync
+
+    def download_flat(self, sync_started=None):
+        """Synchronizes the course from the single flat view of all files. The folders above
+        changed files are listed again, in case one of them was renamed. Returns False if the
+        folder of a file is unknown, the course has to be crawled recursively then."""
+        if self.crawl_strategy == CRAWL_RECURSIVE or self.state is None:
+            return False
+
+        folder_tree = self.state.folder_tree(self.course_id)
+        if not folder_tree:
+            return False
+
+        if self.form_data_files_flat is None:
+            with stats.phase("crawl"):
+                self.last_edit, self.form_data_files_flat = self.session.get_files_flat(
+                    self.course_id)
+
+        if self.form_data_files_flat is None:
+            return False
+
+        form_data_files, _ = check_and_cleanup_form_data(self.form_data_files_flat, [])
+
+        listings = self.list_changed_folders(folder_tree, form_data_files)
+        if listings:
+            folder_tree = self.state.folder_tree(self.course_id, listings)
+
+        files_by_folder = {folder_id: [] for folder_id in folder_tree}
+        for file_data in form_data_files:
+            if file_data.get("folder_id") not in folder_tree:
+                return False
+
+            files_by_folder[file_data["folder_id"]].append(file_data)
+
+        downloads = []
+        folders = []
+
+        try:
+            for folder_id, folder_files in files_by_folder.items():
+                folder_path_relative = folder_tree[folder_id][1]
+
+                # The root folder is stored without its id
+                if folder_path_relative == "":
+                    folder_id = ""
+
+                folder_downloads = self.queue_folder_downloads(
+                    folder_id or None, folder_path_relative, folder_files, form_data_files)
+                downloads.extend(folder_downloads)
+
+                folder = self.state.folder(self.course_id, folder_id)
+                if folder_id in listings:
+                    folders.append((folder_id, listings[folder_id], folder_downloads))
+                elif folder is not None:
+                    folders.append((folder_id, folder[1], folder_downloads))
+        except BaseException:
+            for future in downloads:
+                future.cancel()
+            raise
+        finally:
+            self.finish_folders(downloads, folders, sync_started)
+
+        raise_failures(downloads)
+        return True
+
+    def list_changed_folders(self, folder_tree, form_data_files):
+        """Lists the folders above the folders with changed files again and returns their
+        subfolders by folder id (the root folder without its id)"""
+        changed = set()
+        for file_data in form_data_files:
+            folder_id = file_data.get("folder_id")
+            if folder_id not in folder_tree:
+                continue
+
+            folder = self.state.folder(self.course_id, folder_id if folder_tree[folder_id][0]
+                                       is not None else "")
+            if folder is None or file_data["chdate"] > folder[0]:
+                changed.add(folder_id)
+
+        parents = set()
+        for folder_id in changed:
+            parent = folder_tree[folder_id][0]
+            while parent is not None and parent not in parents:
+                parents.add(parent)
+                parent = folder_tree[parent][0]
+
+        if not parents:
+            return {}
+
+        def list_folder(folder_id):
+            is_root = folder_tree[folder_id][0] is None
+            try:
+                with stats.phase("crawl"):
+                    _, form_data_folders = self.session.get_files_index(
+                        self.course_id, None if is_root else folder_id)
+            except MissingPermissionFolderError:
+                return None
+
+            _, form_data_folders = check_and_cleanup_form_data([], form_data_folders)
+            return "" if is_root else folder_id, form_data_folders
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            listed = executor.map(stats.bind(output.bind(list_folder)), sorted(parents))
+            return dict(listing for listing in listed if listing is not None)
+
+    def download_recursive(self, sync_started=None):
+        downloads = []
+        folders = []
+
+        try:
+            self.crawl(downloads, folders)
+        except BaseException:
+            for future in downloads:
+                future.cancel()
+            raise
+        finally:
+            self.finish_folders(downloads, folders, sync_started)
+
+        raise_failures(downloads)
+
+    def finish_folders(self, downloads, folders, sync_started):
+        # Wait for all downloads of this course, even if some of them fail
+        wait(downloads)
+
+        # Every folder whose files are all synchronized is up to date now
+        if self.state is not None and sync_started is not None:
+            for folder_id, form_data_folders, folder_downloads in folders:
+                if all(not f.cancelled() and f.exception() is None for f in folder_downloads):
+                    self.state.update_folder(self.course_id, folder_id, sync_started,
+                                             form_data_folders)
+
+    def crawl(self, downloads, folders):
+        # Folder listings are fetched by the pool while the files of already listed folders
+        # are queued for download, so downloads start before the crawl has finished.
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            get_folder = stats.bind(output.bind(self.get_folder))
+            pending = {executor.submit(get_folder, None, "")}
+
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        folder = future.result()
+                        if folder is None:
+                            continue
+
+                        folder_id, folder_path_relative, form_data_files, form_data_folders = \
+                            folder
+
+                        for folder_data in form_data_folders:
+                            new_folder_path_relative = os.path.join(folder_path_relative,
+                                                                    folder_data["name"])
+                            pending.add(executor.submit(get_folder, folder_data["id"],
+                                                        new_folder_path_relative))
+
+                        folder_downloads = self.queue_folder_downloads(
+                            folder_id, folder_path_relative, form_data_files, form_data_files)
+
+                        downloads.extend(folder_downloads)
+                        folders.append((folder_id, form_data_folders, folder_downloads))
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+    def is_folder_up_to_date(self, folder_id):
+        if self.state is None or self.sync_fully or not self.last_edit:
+            return None
+
+        folder = self.state.folder(self.course_id, folder_id)
+        if folder is None:
+            return None
+
+        folder_watermark, form_data_folders = folder
+        if folder_watermark < self.last_edit:
+            return None
+
+        return form_data_folders
+
+    @stats.phase("crawl")
+    def get_folder(self, folder_id, folder_path_relative):
+        # Nothing in this course changed since this folder was synchronized the last time,
+        # so the known subfolders are crawled without requesting the folder itself.
+        known_folders = self.is_folder_up_to_date(folder_id)
+        if known_folders is not None:
+            return folder_id, folder_path_relative, [], known_folders
 
-    def download_recursive(self, folder_id=None, folder_path_relative=""):
         try:
             form_data_files, form_data_folders = self.session.get_files_index(self.course_id,
                                                                               folder_id)
         except MissingPermissionFolderError:
             log("Couldn't view the following folder because of missing permissions: " +
                 folder_path_relative)
-            return
+            return None
 
         form_data_files, form_data_folders = check_and_cleanup_form_data(form_data_files,
                                                                          form_data_folders
                                                                          )
 
-        for file_data in form_data_files:
-            folder_absolute = os.path.join(self.root_folder, folder_path_relative)
+        if folder_id is None and self.state is not None and self.plan is None:
+            # The flat view refers to the root folder by its id, which is only known from its files
+            root_folder_ids = {f["folder_id"] for f in form_data_files if "folder_id" in f}
+            if len(root_folder_ids) == 1:
+                self.state.update_root_folder(self.course_id, root_folder_ids.pop())
+
+        return folder_id, folder_path_relative, form_data_files, form_data_folders
+
+    def queue_folder_downloads(self, folder_id, folder_path_relative, folder_files,
+                               form_data_files):
+        if self.plan is not None:
+            for file_data in folder_files:
+                self.plan_file(file_data, folder_path_relative)
+            return []
+
+        if self.bulk and len(folder_files) >= BULK_MIN_FILES:
+            # The archive is scheduled like a single file of the size of all its files
+            archive_data = {"size": sum(file_data["size"] for file_data in folder_files),
+                            "chdate": max(file_data["chdate"] for file_data in folder_files)}
+            return [self.queue(self.download_folder_bulk, folder_id, folder_path_relative,
+                               folder_files, form_data_files, file_data=archive_data)]
+
+        return [self.queue(self.download_file, file_data, folder_path_relative, form_data_files,
+                           file_data=file_data)
+                for file_data in folder_files]
+
+    def queue(self, func, *args, file_data=None):
+        if self.downloads is None:
+            future = Future()
+            future.set_result(self.run_download(func, *args))
+            return future
+
+        return self.downloads.submit(self.run_download, func, *args, file_data=file_data,
+                                     course=self.course)
+
+    def run_download(self, func, *args):
+        if self.breaker.is_open():
+            raise DownloadError("Skipped after {} failed downloads of this course".format(
+                self.breaker.failures))
+
+        try:
+            result = func(*args)
+        except (SessionError, ParserError, OSError):
+            self.breaker.failure()
+            raise
+
+        self.breaker.success()
+        return result
+
+    @stats.phase("files")
+    def download_folder_bulk(self, folder_id, folder_path_relative, folder_files,
+                             form_data_files):
+        """Downloads all new files of a folder as one archive, if there are enough of them.
+        Files which can be restored from the store are left out of the archive.
+
+        There is one archive per folder, also for the first sync of a course: the paths in an
+        archive of the whole course would have to be matched to the local folder paths, which
+        differ from the names on Stud.IP (normalized, without "/") and are ambiguous for folders
+        of the same name."""
+        folder_absolute = os.path.join(self.root_folder, folder_path_relative)
+
+        new_files = []
+        for file_data in folder_files:
             file_path = os.path.join(folder_absolute, file_data["name"])
-            if is_file_new(file_data, file_path):
-                log("Downloading: {}: {}".format(file_data["id"], file_data["name"]))
-
-                target_file = os.path.join(self.workdir, file_data["id"])
-                self.session.download_file(file_data["download_url"], target_file)
-
-                file_size = int(file_data["size"])
-                target_file_size = os.path.getsize(target_file)
-                if target_file_size != file_size:
-                    if ARGS.v:
-                        print("[Debug] " + str(form_data_files))
-                    raise DownloadError("File size didn't match expected file size: " + file_path)
-
-                file_path_base, file_path_name = os.path.split(file_path)
-                if os.path.exists(file_path):
-                    timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
-                    suffix = "_" + timestr + ".old"
-                    new_file_path = os.path.join(file_path_base, file_path_name + suffix)
-                    os.rename(file_path, new_file_path)
-                else:
-                    os.makedirs(file_path_base, exist_ok=True)
-
-                if os.path.exists(file_path):
-                    raise DownloadError("File exists already, even after moving it away: " +
+            if self.is_file_new(file_data, file_path) and \
+                    not self.restore_from_store(file_data, file_path):
+                new_files.append((file_data, file_path))
+
+        remaining_files = new_files
+        if len(new_files) >= BULK_MIN_FILES:
+            log("Downloading {} files as archive: {}".format(len(new_files),
+                                                             folder_path_relative or "/"))
+
+            os.makedirs(folder_absolute, exist_ok=True)
+            archive_path = os.path.join(folder_absolute,
+                                        ".studip-sync-{}.zip.part".format(folder_id or "root"))
+
+            try:
+                self.session.download(self.course_id, archive_path,
+                                      [file_data["id"] for file_data, _ in new_files],
+                                      folder_id)
+                remaining_files = self.extract_archive(archive_path, new_files)
+            except (DownloadError, ParserError, zipfile.BadZipFile) as e:
+                log("Archive download failed, downloading the files one by one: {}".format(e))
+            finally:
+                if os.path.exists(archive_path):
+                    os.remove(archive_path)
+
+        for file_data, _ in remaining_files:
+            self.download_file(file_data, folder_path_relative, form_data_files, checked=True)
+
+    def extract_archive(self, archive_path, new_files):
+        """Extracts the new files from the archive. Returns the files which are missing in the
+        archive or don't have the expected size."""
+        remaining_files = []
+
+        with zipfile.ZipFile(archive_path) as archive:
+            members = {}
+            for member in archive.infolist():
+                if not member.is_dir():
+                    name = unicodedata.normalize(UNICODE_NORMALIZE_MODE,
+                                                 os.path.basename(member.filename))
+                    members[name] = member
+
+            for file_data, file_path in new_files:
+                member = members.get(file_data["name"])
+                if member is None or member.file_size != int(file_data["size"]):
+                    remaining_files.append((file_data, file_path))
+                    continue
+
+                target_file = get_partial_file_path(file_path, file_data["id"])
+                checksum = hashlib.sha256()
+
+                with archive.open(member) as source, open(target_file, "wb") as target:
+                    for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        checksum.update(chunk)
+                        target.write(chunk)
+
+                if os.path.getsize(target_file) != int(file_data["size"]):
+                    os.remove(target_file)
+                    raise DownloadError("File size didn't match expected file size: " +
                                         file_path)
 
-                shutil.copyfile(target_file, file_path)
+                install_file(target_file, file_path, self.history, file_data["id"])
+                self.update_manifest(file_data, file_path, checksum.hexdigest())
+                self.add_to_store(file_path, checksum.hexdigest())
+
+        return remaining_files
+
+    @stats.phase("files")
+    def download_file(self, file_data, folder_path_relative, form_data_files, checked=False):
+        folder_absolute = os.path.join(self.root_folder, folder_path_relative)
+        file_path = os.path.join(folder_absolute, file_data["name"])
+        if not checked and not self.is_file_new(file_data, file_path):
+            return
+
+        if self.restore_from_store(file_data, file_path):
+            return
+
+        log("Downloading: {}: {}".format(file_data["id"], file_data["name"]))
+
+        # Download next to the destination, so that it can be moved into place atomically
+        os.makedirs(folder_absolute, exist_ok=True)
+        target_file = get_partial_file_path(file_path, file_data["id"])
+
+        partial_file = PartialFile(target_file, file_data)
+        offset = partial_file.resume_offset()
+        if offset:
+            log("Resuming download at byte {}: {}".format(offset, file_data["name"]))
 
-        for folder_data in form_data_folders:
-            new_folder_path_relative = os.path.join(folder_path_relative, folder_data["name"])
+        try:
+            checksum = self.session.download_file(file_data["download_url"], target_file, offset)
+        except RESUMABLE_DOWNLOAD_ERRORS:
+            raise
+        except Exception:
+            # E.g. an error page instead of the file, which must not be resumed by the next sync
+            partial_file.remove()
+            raise
+
+        file_size = int(file_data["size"])
+        target_file_size = os.path.getsize(target_file)
+        if target_file_size != file_size:
+            output.debug(str(form_data_files))
+
+            # A file which is too short is resumed by the next sync
+            if target_file_size > file_size:
+                partial_file.remove()
+
+            raise DownloadError("File size didn't match expected file size: " + file_path)
+
+        partial_file.complete()
+        install_file(target_file, file_path, self.history, file_data["id"])
+
+        self.update_manifest(file_data, file_path, checksum)
+        self.add_to_store(file_path, checksum)
+
+    def add_to_store(self, file_path, checksum):
+        if self.store is None:
+            return
+
+        try:
+            if self.store.add(file_path, checksum):
+                log("Deduplicated: {}".format(file_path))
+        except OSError as e:
+            log("Couldn't add file to the store: {}: {}".format(file_path, e))
+
+    def restore_from_store(self, file_data, file_path):
+        """Links a file which is missing locally, but was downloaded before, from the store
+        instead of downloading it again. Returns True if it was restored."""
+        if self.store is None or self.manifest is None or os.path.exists(file_path):
+            return False
+
+        entry = self.manifest.get(file_data["id"])
+        if entry is None or not entry["checksum"] or entry["chdate"] != file_data["chdate"] or \
+                entry["size"] != file_data["size"]:
+            return False
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        try:
+            if not self.store.restore(entry["checksum"], file_path):
+                return False
+        except OSError:
+            return False
 
-            # self.log("Accessing folder: " + folder_data["id"] + ": " + folder_data["name"])
-            self.download_recursive(folder_data["id"], new_folder_path_relative)
+        log("Restored from the store: {}".format(file_path))
+        self.update_manifest(file_data, file_path, entry["checksum"])
+        return True
+
+    def plan_file(self, file_data, folder_path_relative):
+        """Adds the file to the plan if it is new, changed or moved, like is_file_new decides,
+        but without moving it or updating the manifest"""
+        file_path = os.path.join(self.root_folder, folder_path_relative, file_data["name"])
+
+        entry = None
+        if self.manifest is not None and not self.sync_fully:
+            entry = self.manifest.get(file_data["id"])
+
+        moved_from = None
+        if entry is not None and entry["path"] != file_path:
+            if os.path.exists(entry["path"]) and not os.path.exists(file_path):
+                moved_from = entry["path"]
+            else:
+                entry = None
+
+        if entry is None:
+            if not is_file_new(file_data, file_path, verbose=False):
+                return
+            reason = REASON_CHANGED if os.path.exists(file_path) else REASON_NEW
+        elif file_data["chdate"] > entry["chdate"] or file_data["size"] != entry["size"]:
+            reason = REASON_CHANGED
+        elif moved_from is not None:
+            reason = REASON_MOVED
+        else:
+            return
+
+        self.plan.add(self.course, self.root_folder, folder_path_relative, file_data, reason,
+                      moved_from)
+
+    def is_file_new(self, file_data, file_path):
+        if self.manifest is None or self.sync_fully:
+            return self.is_file_new_on_disk(file_data, file_path)
+
+        entry = self.manifest.get(file_data["id"])
+        if entry is None:
+            return self.is_file_new_on_disk(file_data, file_path)
+
+        if entry["path"] != file_path:
+            # The file was renamed or moved on Stud.IP, so move the local copy as well
+            if not self.move_file(entry["path"], file_path):
+                return self.is_file_new_on_disk(file_data, file_path)
+
+            log("File moved: {} -> {}".format(entry["path"], file_path))
+            self.manifest.update_path(file_data["id"], file_path)
+
+        if file_data["chdate"] > entry["chdate"]:
+            log("File changed: time: {} - {} : {}".format(file_data["chdate"], entry["chdate"],
+                                                          file_path))
+            return True
+
+        if file_data["size"] != entry["size"]:
+            log("File changed: size: {} - {} : {}".format(file_data["size"], entry["size"],
+                                                          file_path))
+            return True
+
+        return False
+
+    def is_file_new_on_disk(self, file_data, file_path):
+        if is_file_new(file_data, file_path):
+            return True
+
+        # Known from now on, the next run doesn't need to check the disk again
+        if file_data["size"]:
+            self.update_manifest(file_data, file_path)
+
+        return False
+
+    def update_manifest(self, file_data, file_path, checksum=None):
+        if self.manifest is None:
+            return
+
+        self.manifest.update(file_data["id"], self.course_id, file_data["chdate"],
+                             file_data["size"], file_path, checksum)
+
+    @staticmethod
+    def move_file(old_file_path, new_file_path):
+        if not os.path.exists(old_file_path) or os.path.exists(new_file_path):
+            return False
+
+        os.makedirs(os.path.dirname(new_file_path), exist_ok=True)
+        os.rename(old_file_path, new_file_path)
+        return True
@@ -0,0 +1,150 @@
+import io
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+import urllib3
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+CORPUS_INDEX_FILENAME = "index.jsonl"
+SCRUBBED = "scrubbed"
+
+# Headers which carry the login session
+SCRUBBED_HEADERS = {"set-cookie", "cookie", "authorization"}
+
+# Form inputs which carry a token of the login session or the credentials, whatever the order
+# of their attributes
+INPUT_TAG = re.compile(r"<input\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>", re.IGNORECASE)
+SCRUBBED_INPUT_NAME = re.compile(
+    r"(?<![\w-])name\s*=\s*[\"']?(?:security_token|login_ticket|loginname|password)(?![\w-])",
+    re.IGNORECASE)
+INPUT_VALUE = re.compile(r"(?<![\w-])(value\s*=\s*)(?:\"[^\"]*\"|'[^']*'|[^\s\"'>]*)",
+                         re.IGNORECASE)
+
+
+def corpus_key(method, url):
+    """Requests are matched by their method, path and query, the host doesn't matter"""
+    url = urllib.parse.urlsplit(url)
+    return "{} {}".format(method, urllib.parse.urlunsplit(("", "", url.path, url.query, "")))
+
+
+def scrub_input(match):
+    tag = match.group(0)
+    if not SCRUBBED_INPUT_NAME.search(tag):
+        return tag
+
+    return INPUT_VALUE.sub(lambda value: '{}"{}"'.format(value.group(1), SCRUBBED), tag)
+
+
+class RecordingTransport(BaseAdapter):
+    """Passes requests on to adapter and records the responses to a corpus directory, which
+    ReplayTransport can answer the same requests from offline.
+
+    Cookies, session tokens and credentials in forms and the given secrets (e.g. the username, as
+    whole words) are scrubbed. The bodies of streamed responses (file downloads) aren't recorded.
+    """
+
+    def __init__(self, adapter, path, secrets=()):
+        super(RecordingTransport, self).__init__()
+        self.adapter = adapter
+        self.path = path
+        # Secrets are only replaced as whole words, e.g. a short username within other words,
+        # URLs or markup is kept
+        self.secrets = [re.compile(r"(?<![\w.@-]){}(?![\w.@-])".format(re.escape(secret)))
+                        for secret in secrets if secret]
+
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._count = len(load_corpus(path))
+
+    def send(self, request, stream=False, **kwargs):
+        response = self.adapter.send(request, stream=stream, **kwargs)
+
+        entry = {
+            "key": corpus_key(request.method, request.url),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {name: value for name, value in response.headers.items()
+                        if name.lower() not in SCRUBBED_HEADERS},
+            "body": None
+        }
+
+        body = None if stream else self.scrub(response.content)
+
+        with self._lock:
+            if body is not None:
+                entry["body"] = "{:05d}.body".format(self._count)
+                with open(os.path.join(self.path, entry["body"]), "wb") as body_file:
+                    body_file.write(body)
+
+            self._count += 1
+            with open(os.path.join(self.path, CORPUS_INDEX_FILENAME), "a") as index_file:
+                index_file.write(json.dumps(entry) + "\n")
+
+        return response
+
+    def scrub(self, body):
+        body = INPUT_TAG.sub(scrub_input, body.decode("utf-8", "surrogateescape"))
+
+        for secret in self.secrets:
+            body = secret.sub(SCRUBBED, body)
+
+        return body.encode("utf-8", "surrogateescape")
+
+    def close(self):
+        # The adapter is closed by its owner
+        pass
+
+
+class ReplayTransport(HTTPAdapter):
+    """Answers requests from a corpus recorded by RecordingTransport, without any network access.
+
+    Responses to the same request are replayed in the recorded order, the last one is repeated.
+    Requests which weren't recorded are answered with 404.
+    """
+
+    def __init__(self, path):
+        super(ReplayTransport, self).__init__()
+        self.path = path
+        self._responses = {}
+        self._lock = threading.Lock()
+
+        for entry in load_corpus(path):
+            self._responses.setdefault(entry["key"], []).append(entry)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = corpus_key(request.method, request.url)
+
+        with self._lock:
+            entries = self._responses.get(key)
+            if not entries:
+                entry = {"status": 404, "reason": "Not Recorded", "headers": {}, "body": None}
+            elif len(entries) > 1:
+                entry = entries.pop(0)
+            else:
+                entry = entries[0]
+
+        body = b""
+        if entry["body"] is not None:
+            with open(os.path.join(self.path, entry["body"]), "rb") as body_file:
+                body = body_file.read()
+
+        # The recorded body is already decoded
+        headers = {name: value for name, value in entry["headers"].items()
+                   if name.lower() not in ("content-encoding", "transfer-encoding")}
+        headers["Content-Length"] = str(len(body))
+
+        raw = urllib3.HTTPResponse(body=io.BytesIO(body), headers=headers,
+                                   status=entry["status"], reason=entry["reason"],
+                                   preload_content=False, decode_content=False)
+        return self.build_response(request, raw)
+
+
+def load_corpus(path):
+    try:
+        with open(os.path.join(path, CORPUS_INDEX_FILENAME)) as index_file:
+            return [json.loads(line) for line in index_file if line.strip()]
+    except FileNotFoundError:
+        return []
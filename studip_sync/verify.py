@@ -0,0 +1,38 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from studip_sync.store import file_checksum
+
+VERIFY_OK = "ok"
+VERIFY_MISSING = "missing"
+VERIFY_SIZE = "size"
+VERIFY_CHECKSUM = "checksum"
+VERIFY_UNKNOWN = "unknown"
+
+
+def verify_file(entry):
+    """Checks the local copy of a file of the manifest. Returns one of the VERIFY_* results."""
+    try:
+        size = os.path.getsize(entry["path"])
+    except OSError:
+        return VERIFY_MISSING
+
+    if size != entry["size"]:
+        return VERIFY_SIZE
+
+    if not entry["checksum"]:
+        return VERIFY_UNKNOWN
+
+    try:
+        checksum = file_checksum(entry["path"])
+    except OSError:
+        return VERIFY_MISSING
+
+    return VERIFY_OK if checksum == entry["checksum"] else VERIFY_CHECKSUM
+
+
+def verify_files(entries, jobs=1):
+    """Checks the local copies of the given manifest entries, reading up to jobs files at the
+    same time. Yields every entry together with its result."""
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        yield from zip(entries, executor.map(verify_file, entries))
@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "benchmarks"))
+
+from mock_studip import CourseTree, MockStudIPServer  # noqa: E402
+from studip_sync.http_cache import ResponseCache  # noqa: E402
+from studip_sync.logins.general import GeneralLogin  # noqa: E402
+from studip_sync.session import ConnectionPool, Session  # noqa: E402
+
+
+def test_unchanged_pages_are_answered_from_the_cache(tmp_path):
+    server = MockStudIPServer(CourseTree(courses=1, folders=1, depth=1, files=2)).start()
+    cache = ResponseCache(str(tmp_path))
+    parsed = []
+
+    def parse(html):
+        parsed.append(html)
+        return len(html)
+
+    try:
+        with ConnectionPool() as pool, \
+                Session(base_url=server.base_url, pool=pool, cache=cache) as session:
+            GeneralLogin.login(session, server.username, server.password, {})
+            url = session.url.files_flat()
+            params = {"cid": server.tree.courses[0]["id"]}
+
+            first = session.get_parsed(url, parse, params)
+            second = session.get_parsed(url, parse, params)
+
+        assert second == first
+        assert len(parsed) == 1
+        assert server.not_modified == 1
+    finally:
+        server.shutdown()
@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_studip import CourseTree, MockStudIPServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    tree = CourseTree(courses=2, folders=3, depth=2, files=2, file_size=1024)
+    server = MockStudIPServer(tree).start()
+    yield server
+    server.shutdown()
+
+
+def write_config(server, tmp_path):
+    config_path = os.path.join(str(tmp_path), "config", "config.json")
+    destination = os.path.join(str(tmp_path), "files")
+    os.makedirs(os.path.dirname(config_path))
+
+    with open(config_path, "w") as config_file:
+        json.dump({
+            "user": {"login": server.username, "password": server.password},
+            "base_url": server.base_url,
+            "files_destination": destination
+        }, config_file)
+
+    return config_path, destination
+
+
+def sync(server, config_path, *args):
+    server.reset_counters()
+    process = subprocess.run([sys.executable, os.path.join(ROOT, "studip_sync.py"),
+                              "-c", config_path] + list(args),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert process.returncode == 0, process.stdout.decode("utf-8", "replace")
+    return server.requests
+
+
+def synchronized_files(destination):
+    # Without the previous versions, which are named by the time of the sync
+    return sorted(os.path.relpath(os.path.join(root, name), destination)
+                  for root, _, names in os.walk(destination) for name in names
+                  if not name.endswith(".old"))
+
+
+def change_file(server, folder_name):
+    """Uploads a new version of the first file in the first folder with the given name"""
+    folder = next(folder for folder in server.tree.folders.values()
+                  if folder["name"] == folder_name)
+    file = server.tree.files[folder["files"][0]]
+    file["version"] += 1
+    file["chdate"] = int(time.time())
+    return folder
+
+
+def test_incremental_sync_lists_fewer_folders_with_the_flat_view(server, tmp_path):
+    configs = {}
+    for crawl in ("auto", "recursive"):
+        configs[crawl], _ = write_config(server, tmp_path / crawl)
+        sync(server, configs[crawl], "--crawl", crawl)
+
+    # Changes must be newer than the last sync
+    time.sleep(1)
+    change_file(server, "Folder 0")
+
+    requests = {crawl: sync(server, config_path, "--crawl", crawl)
+                for crawl, config_path in configs.items()}
+
+    course_folders = sum(1 for folder in server.tree.folders.values()
+                         if folder["course"] == server.tree.courses[0]["id"])
+    assert requests["recursive"] > course_folders
+    # Only the folders above the changed file are listed again
+    assert requests["auto"] <= requests["recursive"] - course_folders + 3
+
+
+def test_flat_view_follows_renamed_folders(server, tmp_path):
+    destinations = {}
+
+    for crawl in ("auto", "recursive"):
+        config_path, destination = write_config(server, tmp_path / crawl)
+        sync(server, config_path, "--crawl", crawl)
+        destinations[crawl] = destination
+
+    time.sleep(1)
+    folder = change_file(server, "Folder 1")
+    folder["name"] = "Renamed"
+
+    for crawl, destination in destinations.items():
+        sync(server, os.path.join(os.path.dirname(destination), "config", "config.json"),
+             "--crawl", crawl)
+
+    files = synchronized_files(destinations["auto"])
+    assert any("Renamed" in path for path in files)
+    assert files == synchronized_files(destinations["recursive"])
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "benchmarks"))
+
+from mock_studip import CourseTree, MockStudIPServer  # noqa: E402
+from studip_sync.logins.general import GeneralLogin  # noqa: E402
+from studip_sync.session import ConnectionPool, DownloadError, Session  # noqa: E402
+from studip_sync.studip_rsync import CourseRSync  # noqa: E402
+
+
+def start_server(drop_rate):
+    tree = CourseTree(courses=1, folders=0, depth=0, files=8, file_size=256 * 1024)
+    return MockStudIPServer(tree, drop_rate=drop_rate).start()
+
+
+def file_data(server, file_id):
+    file = server.tree.files[file_id]
+    return {
+        "id": file_id,
+        "name": file["name"],
+        "size": file["size"],
+        "chdate": file["chdate"],
+        "download_url": "{}sendfile.php?type=0&file_id={}".format(server.base_url, file_id)
+    }
+
+
+@pytest.mark.parametrize("drop_rate", [1.0, 0.5])
+def test_download_file_resumes_dropped_connections(tmp_path, drop_rate):
+    server = start_server(drop_rate)
+
+    try:
+        with ConnectionPool(retries=3) as pool, \
+                Session(base_url=server.base_url, pool=pool) as session:
+            GeneralLogin.login(session, server.username, server.password, {})
+
+            course = {"course_id": server.tree.courses[0]["id"], "save_as": "Course",
+                      "semester": "Semester"}
+            course_sync = CourseRSync(session, str(tmp_path), course, sync_fully=True)
+
+            for file_id in server.tree.files:
+                course_sync.download_file(file_data(server, file_id), "", [])
+
+        for file_id, file in server.tree.files.items():
+            with open(os.path.join(str(tmp_path), file["name"]), "rb") as downloaded_file:
+                checksum = hashlib.sha256(downloaded_file.read()).hexdigest()
+
+            assert checksum == hashlib.sha256(server.tree.content(file_id)).hexdigest()
+
+        # Dropped connections were resumed instead of downloading the whole file again
+        assert server.bytes_sent < 2 * server.tree.total_size()
+        assert sorted(os.listdir(str(tmp_path))) == sorted(
+            file["name"] for file in server.tree.files.values())
+    finally:
+        server.shutdown()
+
+
+def test_download_file_removes_partial_files_of_failed_downloads(tmp_path):
+    server = start_server(0.0)
+
+    try:
+        with ConnectionPool(retries=0) as pool, \
+                Session(base_url=server.base_url, pool=pool) as session:
+            GeneralLogin.login(session, server.username, server.password, {})
+
+            course = {"course_id": server.tree.courses[0]["id"], "save_as": "Course",
+                      "semester": "Semester"}
+            course_sync = CourseRSync(session, str(tmp_path), course, sync_fully=True)
+
+            # Deleted on the server, which answers with an error page
+            missing_file = {"id": "0" * 32, "name": "Missing.pdf", "size": 1024, "chdate": 0,
+                            "download_url": "{}sendfile.php?type=0&file_id={}".format(
+                                server.base_url, "0" * 32)}
+
+            with pytest.raises(DownloadError):
+                course_sync.download_file(missing_file, "", [])
+
+        assert os.listdir(str(tmp_path)) == []
+    finally:
+        server.shutdown()
@@ -0,0 +1,24 @@
+import os
+
+from studip_sync.history import VersionHistory
+
+
+def write(path, content):
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def test_add_keeps_versions_of_hardlinked_files_intact(tmp_path):
+    file_path = os.path.join(str(tmp_path), "file.pdf")
+    other_path = os.path.join(str(tmp_path), "copy.pdf")
+    write(file_path, b"version 1")
+    # Like a deduplicated copy in another course
+    os.link(file_path, other_path)
+
+    with VersionHistory(os.path.join(str(tmp_path), "history")) as history:
+        history.add(file_path)
+        write(other_path, b"modified")
+
+        version, = history.versions()
+        with open(history.object_path(version["checksum"]), "rb") as object_file:
+            assert object_file.read() == b"version 1"
@@ -0,0 +1,74 @@
+import glob
+import json
+import os
+
+import pytest
+
+from studip_sync import parsers
+
+PAGES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages",
+                                      "files_*.html")))
+
+
+def read_page(path):
+    with open(path, encoding="utf-8") as page_file:
+        return page_file.read()
+
+
+def soup_form_attributes(html, form_id):
+    form = parsers.parse_html(html).find("form", id=form_id)
+    if form is None:
+        return None
+
+    # BeautifulSoup splits multi-valued attributes like class
+    return {name: " ".join(value) if isinstance(value, list) else value
+            for name, value in form.attrs.items()}
+
+
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_find_form_attributes_matches_full_parse(path):
+    html = read_page(path)
+
+    attributes = parsers.find_form_attributes(html, "files_table_form")
+
+    assert attributes is not None
+    assert attributes == soup_form_attributes(html, "files_table_form")
+
+
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_extract_files_index_data_matches_full_parse(path):
+    html = read_page(path)
+    attributes = soup_form_attributes(html, "files_table_form")
+
+    form_data_files, form_data_folders = parsers.extract_files_index_data(html)
+
+    assert form_data_files == json.loads(attributes["data-files"])
+    assert form_data_folders == json.loads(attributes["data-folders"])
+
+
+def test_parse_html_returns_a_new_soup_for_every_call():
+    html = read_page(PAGES[0])
+
+    assert parsers.parse_html(html) is not parsers.parse_html(html)
+
+
+def test_extract_files_flat_parses_pages_without_data_files_once(monkeypatch):
+    html = ('<html><body><form id="files_table_form" action="#"><table><tbody>'
+            '<tr><td>Keine Dateien vorhanden.</td></tr></tbody></table></form></body></html>')
+    parse_html = parsers.parse_html
+    calls = []
+    monkeypatch.setattr(parsers, "parse_html", lambda page: calls.append(page) or parse_html(page))
+
+    assert parsers.extract_files_flat(html) == (0, None)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_extract_files_flat_reads_data_files(path):
+    html = read_page(path)
+    form_data_files = json.loads(soup_form_attributes(html, "files_table_form")["data-files"])
+
+    last_edit, data_files = parsers.extract_files_flat(html)
+
+    assert data_files == form_data_files
+    assert last_edit == max((file["chdate"] for file in form_data_files), default=0)
@@ -0,0 +1,25 @@
+import pytest
+
+from studip_sync.transport import RecordingTransport
+
+
+@pytest.mark.parametrize("tag", [
+    '<input type="hidden" name="password" value="hunter2">',
+    '<input value="hunter2" name="password">',
+    "<INPUT VALUE='hunter2' TYPE=password NAME=password>",
+    '<input data-x=">" value="hunter2" name="security_token">',
+])
+def test_scrub_removes_the_values_of_secret_inputs(tmp_path, tag):
+    transport = RecordingTransport(None, str(tmp_path))
+
+    scrubbed = transport.scrub("<form>{}</form>".format(tag).encode("utf-8")).decode("utf-8")
+
+    assert "hunter2" not in scrubbed
+    assert "scrubbed" in scrubbed
+
+
+def test_scrub_keeps_other_inputs(tmp_path):
+    transport = RecordingTransport(None, str(tmp_path))
+    body = b'<input value="keep" name="password_hint"><input data-name="password" value="keep">'
+
+    assert transport.scrub(body) == body